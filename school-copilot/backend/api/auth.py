@@ -1,26 +1,54 @@
 """Authentication API endpoints."""
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.security import HTTPAuthorizationCredentials
 
-from ..models.database import get_db
 from ..models.models import User
 from ..schemas.auth import LoginRequest, AuthResponse, UserInfo
-from ..auth.auth_service import AuthService
-from ..auth.dependencies import get_current_user, get_current_admin
+from ..auth.auth_service import AuthService, role_satisfies
+from ..auth.jwt_handler import jwt_handler
+from ..auth.dependencies import (
+    TOKEN_CACHE_CONTROL,
+    get_current_user,
+    get_current_admin,
+    get_auth_service,
+    hash_token,
+    invalidate_token,
+    invalidate_user,
+    security as bearer_scheme,
+    token_etag,
+)
 from ..utils.validation import validate_login_request, ValidationError
 
-router = APIRouter(prefix="/auth", tags=["authentication"])
-security = HTTPBearer()
+router = APIRouter()
+
+_VALID_ROLES = frozenset({"teacher", "student", "admin"})
+
+
+def _not_modified(request: Request, response: Response, token: str) -> Optional[Response]:
+    """Answer 304 if the client's ETag matches, else set the validators on the response.
+    
+    Only called after get_current_user has verified the token, so a revoked
+    or expired token never reaches this point.
+    """
+    etag = token_etag(token, request.url.path)
+    if request.headers.get("if-none-match") == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": TOKEN_CACHE_CONTROL}
+        )
+    
+    response.headers["Cache-Control"] = TOKEN_CACHE_CONTROL
+    response.headers["ETag"] = etag
+    return None
 
 
 @router.post("/login", response_model=AuthResponse)
 async def login(
     login_request: LoginRequest,
-    db: Session = Depends(get_db)
+    auth_service: AuthService = Depends(get_auth_service)
 ):
     """Authenticate user and return JWT token."""
     try:
@@ -36,7 +64,6 @@ async def login(
             )
         
         # Authenticate user
-        auth_service = AuthService(db)
         auth_response = await auth_service.authenticate_user(login_request)
         
         if not auth_response:
@@ -60,7 +87,7 @@ async def login(
 
 
 @router.get("/me", response_model=UserInfo)
-async def get_current_user_info(
+def get_current_user_info(
     current_user: User = Depends(get_current_user)
 ):
     """Get current authenticated user information."""
@@ -76,18 +103,18 @@ async def get_current_user_info(
 
 
 @router.post("/refresh")
-async def refresh_token(
+def refresh_token(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
 ):
     """Refresh JWT token for current user."""
     try:
-        auth_service = AuthService(db)
-        
         # Create new token
-        from ..auth.jwt_handler import jwt_handler
         token = jwt_handler.create_user_token(current_user)
-        expires_at = datetime.utcnow() + timedelta(minutes=jwt_handler.access_token_expire_minutes)
+        expires_at = datetime.utcnow() + jwt_handler.access_token_expires
+        
+        # The old token is being replaced; drop its cached verification
+        invalidate_token(hash_token(credentials.credentials))
         
         return {
             "token": token,
@@ -103,10 +130,13 @@ async def refresh_token(
 
 
 @router.post("/logout")
-async def logout(
-    current_user: User = Depends(get_current_user)
+def logout(
+    current_user: User = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
 ):
-    """Logout current user (client should discard token)."""
+    """Logout current user and revoke the bearer token."""
+    invalidate_token(hash_token(credentials.credentials), revoke=True)
+    
     return {
         "message": "Logged out successfully",
         "user_id": current_user.id
@@ -114,13 +144,12 @@ async def logout(
 
 
 @router.post("/create-demo-users")
-async def create_demo_users(
+def create_demo_users(
     current_user: User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    auth_service: AuthService = Depends(get_auth_service)
 ):
     """Create demo users for development/testing (admin only)."""
     try:
-        auth_service = AuthService(db)
         auth_service.create_demo_users()
         
         return {
@@ -140,15 +169,21 @@ async def create_demo_users(
 
 
 @router.get("/check-permissions/{required_role}")
-async def check_permissions(
+def check_permissions(
     required_role: str,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
 ):
     """Check if current user has required role permissions."""
+    not_modified = _not_modified(request, response, credentials.credentials)
+    if not_modified is not None:
+        return not_modified
+    
     try:
-        auth_service = AuthService(db)
-        has_permission = auth_service.check_user_permissions(current_user.id, required_role)
+        # get_current_user has already loaded and validated the active user
+        has_permission = role_satisfies(current_user.role, required_role)
         
         return {
             "user_id": current_user.id,
@@ -165,14 +200,13 @@ async def check_permissions(
 
 
 @router.post("/deactivate-user/{user_id}")
-async def deactivate_user(
+def deactivate_user(
     user_id: str,
     current_user: User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    auth_service: AuthService = Depends(get_auth_service)
 ):
     """Deactivate user account (admin only)."""
     try:
-        auth_service = AuthService(db)
         success = auth_service.deactivate_user(user_id)
         
         if not success:
@@ -181,6 +215,8 @@ async def deactivate_user(
                 detail="User not found"
             )
         
+        invalidate_user(user_id)
+        
         return {
             "message": f"User {user_id} deactivated successfully",
             "deactivated_by": current_user.id
@@ -196,36 +232,25 @@ async def deactivate_user(
 
 
 @router.get("/users/{role}")
-async def get_users_by_role(
+def get_users_by_role(
     role: str,
     current_user: User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    auth_service: AuthService = Depends(get_auth_service)
 ):
     """Get all users with specific role (admin only)."""
     try:
-        if role not in ["teacher", "student", "admin"]:
+        if role not in _VALID_ROLES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid role. Must be 'teacher', 'student', or 'admin'"
             )
         
-        auth_service = AuthService(db)
-        users = auth_service.get_users_by_role(role)
+        users = auth_service.get_user_summaries_by_role(role)
         
         return {
             "role": role,
             "count": len(users),
-            "users": [
-                {
-                    "id": user.id,
-                    "email": user.email,
-                    "name": user.name,
-                    "is_active": user.is_active,
-                    "created_at": user.created_at,
-                    "last_login": user.last_login
-                }
-                for user in users
-            ]
+            "users": users
         }
         
     except HTTPException:
@@ -238,10 +263,17 @@ async def get_users_by_role(
 
 
 @router.get("/validate-token")
-async def validate_token(
-    current_user: User = Depends(get_current_user)
+def validate_token(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
 ):
     """Validate current JWT token."""
+    not_modified = _not_modified(request, response, credentials.credentials)
+    if not_modified is not None:
+        return not_modified
+    
     return {
         "valid": True,
         "user_id": current_user.id,
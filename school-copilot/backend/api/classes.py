@@ -1,11 +1,16 @@
 """Class management API endpoints."""
 
+from datetime import datetime
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import and_, distinct, func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 from ..models.database import get_db
-from ..models.models import User, Class, StudentAccess
+from ..models.models import User, Class, StudentAccess, class_documents
 from ..schemas.classes import (
     ClassCreate,
     ClassResponse,
@@ -13,97 +18,152 @@ from ..schemas.classes import (
     AccessRequest,
     StudentAccessResponse
 )
-from ..auth.dependencies import get_current_teacher, get_current_user, get_permission_checker, PermissionChecker
+from ..auth.permissions import invalidate_class_meta
+from ..auth.dependencies import (
+    get_current_teacher,
+    get_current_user,
+    get_permission_checker,
+    invalidate_class_access,
+    PermissionChecker,
+)
 
 
 router = APIRouter()
 
+# Dialect-specific INSERT constructs supporting ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+def _query_classes_with_counts(db: Session):
+    """Query classes along with their enabled student and document counts."""
+    return (
+        db.query(
+            Class,
+            func.count(distinct(StudentAccess.student_id)),
+            func.count(distinct(class_documents.c.document_id))
+        )
+        .outerjoin(StudentAccess, and_(
+            StudentAccess.class_id == Class.id,
+            StudentAccess.enabled == True
+        ))
+        .outerjoin(class_documents, class_documents.c.class_id == Class.id)
+        .group_by(Class.id)
+    )
+
+
+def _upsert_student_access(db: Session, student_id: str, class_id: str, enabled: bool) -> None:
+    """Create or update a student's access record in a single statement."""
+    upsert_insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert_insert is None:
+        # No ON CONFLICT support; fall back to find-or-create
+        student_access = db.query(StudentAccess).filter(
+            StudentAccess.student_id == student_id,
+            StudentAccess.class_id == class_id
+        ).first()
+        if not student_access:
+            db.add(StudentAccess(student_id=student_id, class_id=class_id, enabled=enabled))
+        else:
+            student_access.enabled = enabled
+        return
+    
+    stmt = upsert_insert(StudentAccess).values(
+        student_id=student_id,
+        class_id=class_id,
+        enabled=enabled
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[StudentAccess.student_id, StudentAccess.class_id],
+        set_={"enabled": stmt.excluded.enabled, "updated_at": datetime.utcnow()}
+    ))
+
+
+def _get_accessible_class(permission_checker: PermissionChecker, user: User, class_id: str) -> Class:
+    """Load a class the user may access, raising 403/404 otherwise."""
+    class_obj = permission_checker.check_class_access(user, class_id)
+    if class_obj:
+        return class_obj
+    
+    if user.role == "admin":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Class not found"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Access denied to this class"
+    )
+
+
+def _class_response(class_obj: Class, student_count: int, document_count: int) -> ClassResponse:
+    """Build a class response from a class and its counts."""
+    return ClassResponse(
+        id=class_obj.id,
+        name=class_obj.name,
+        teacher_id=class_obj.teacher_id,
+        enabled=class_obj.enabled,
+        daily_question_limit=class_obj.daily_question_limit,
+        blocked_terms=class_obj.blocked_terms,
+        created_at=class_obj.created_at,
+        student_count=student_count,
+        document_count=document_count
+    )
+
 
 @router.post("/", response_model=ClassResponse)
-async def create_class(
+def create_class(
     class_data: ClassCreate,
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db)
 ):
     """Create a new class (teachers and admins only)."""
-    import uuid
-    
-    class_id = str(uuid.uuid4())
-    
-    new_class = Class(
-        id=class_id,
-        name=class_data.name,
-        teacher_id=current_user.id,
-        enabled=True,
-        daily_question_limit=class_data.daily_question_limit,
-        blocked_terms=class_data.blocked_terms
-    )
-    
-    db.add(new_class)
+    # id and created_at come from column defaults and are read back via RETURNING
+    new_class = db.scalars(
+        insert(Class).values(
+            name=class_data.name,
+            teacher_id=current_user.id,
+            enabled=True,
+            daily_question_limit=class_data.daily_question_limit,
+            blocked_terms=class_data.blocked_terms
+        ).returning(Class)
+    ).one()
+    # Build the response before commit expires the returned row
+    response = _class_response(new_class, 0, 0)
     db.commit()
-    db.refresh(new_class)
+    invalidate_class_access(current_user.id, response.id)
     
-    return ClassResponse(
-        id=new_class.id,
-        name=new_class.name,
-        teacher_id=new_class.teacher_id,
-        enabled=new_class.enabled,
-        daily_question_limit=new_class.daily_question_limit,
-        blocked_terms=new_class.blocked_terms,
-        created_at=new_class.created_at,
-        student_count=0,
-        document_count=0
-    )
+    return response
 
 
-@router.get("/", response_model=List[ClassResponse])
-async def list_classes(
+@router.get("/", response_model=List[ClassResponse], response_class=ORJSONResponse)
+def list_classes(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """List classes accessible to current user."""
+    query = _query_classes_with_counts(db)
+    
     if current_user.role == "admin":
         # Admins can see all classes
-        classes = db.query(Class).all()
+        pass
     elif current_user.role == "teacher":
         # Teachers can see their own classes
-        classes = db.query(Class).filter(Class.teacher_id == current_user.id).all()
+        query = query.filter(Class.teacher_id == current_user.id)
     else:
         # Students can see classes they're enrolled in
-        student_access = db.query(StudentAccess).filter(
+        enrolled_class_ids = db.query(StudentAccess.class_id).filter(
             StudentAccess.student_id == current_user.id,
             StudentAccess.enabled == True
-        ).all()
-        class_ids = [access.class_id for access in student_access]
-        classes = db.query(Class).filter(Class.id.in_(class_ids)).all() if class_ids else []
-    
-    # Convert to response format with counts
-    response_classes = []
-    for class_obj in classes:
-        student_count = db.query(StudentAccess).filter(
-            StudentAccess.class_id == class_obj.id,
-            StudentAccess.enabled == True
-        ).count()
-        
-        document_count = len(class_obj.documents)
-        
-        response_classes.append(ClassResponse(
-            id=class_obj.id,
-            name=class_obj.name,
-            teacher_id=class_obj.teacher_id,
-            enabled=class_obj.enabled,
-            daily_question_limit=class_obj.daily_question_limit,
-            blocked_terms=class_obj.blocked_terms,
-            created_at=class_obj.created_at,
-            student_count=student_count,
-            document_count=document_count
-        ))
+        )
+        query = query.filter(Class.id.in_(enrolled_class_ids.scalar_subquery()))
     
-    return response_classes
+    return [
+        _class_response(class_obj, student_count, document_count)
+        for class_obj, student_count, document_count in query.all()
+    ]
 
 
 @router.get("/{class_id}", response_model=ClassResponse)
-async def get_class(
+def get_class(
     class_id: str,
     current_user: User = Depends(get_current_user),
     permission_checker: PermissionChecker = Depends(get_permission_checker),
@@ -116,35 +176,18 @@ async def get_class(
             detail="Access denied to this class"
         )
     
-    class_obj = db.query(Class).filter(Class.id == class_id).first()
-    if not class_obj:
+    row = _query_classes_with_counts(db).filter(Class.id == class_id).first()
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Class not found"
         )
     
-    student_count = db.query(StudentAccess).filter(
-        StudentAccess.class_id == class_id,
-        StudentAccess.enabled == True
-    ).count()
-    
-    document_count = len(class_obj.documents)
-    
-    return ClassResponse(
-        id=class_obj.id,
-        name=class_obj.name,
-        teacher_id=class_obj.teacher_id,
-        enabled=class_obj.enabled,
-        daily_question_limit=class_obj.daily_question_limit,
-        blocked_terms=class_obj.blocked_terms,
-        created_at=class_obj.created_at,
-        student_count=student_count,
-        document_count=document_count
-    )
+    return _class_response(*row)
 
 
 @router.put("/{class_id}", response_model=ClassResponse)
-async def update_class(
+def update_class(
     class_id: str,
     class_update: ClassUpdate,
     current_user: User = Depends(get_current_teacher),
@@ -152,18 +195,7 @@ async def update_class(
     db: Session = Depends(get_db)
 ):
     """Update class settings (teachers and admins only)."""
-    if not permission_checker.can_access_class(current_user, class_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this class"
-        )
-    
-    class_obj = db.query(Class).filter(Class.id == class_id).first()
-    if not class_obj:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Class not found"
-        )
+    class_obj = _get_accessible_class(permission_checker, current_user, class_id)
     
     # Update fields if provided
     if class_update.name is not None:
@@ -176,46 +208,27 @@ async def update_class(
         class_obj.blocked_terms = class_update.blocked_terms
     
     db.commit()
-    db.refresh(class_obj)
+    invalidate_class_meta(class_id)
     
-    return ClassResponse(
-        id=class_obj.id,
-        name=class_obj.name,
-        teacher_id=class_obj.teacher_id,
-        enabled=class_obj.enabled,
-        daily_question_limit=class_obj.daily_question_limit,
-        blocked_terms=class_obj.blocked_terms,
-        created_at=class_obj.created_at,
-        student_count=0,  # Could calculate if needed
-        document_count=len(class_obj.documents)
-    )
+    # Reload the class together with its counts instead of lazy-loading documents
+    return _class_response(*_query_classes_with_counts(db).filter(Class.id == class_id).one())
 
 
 @router.post("/set-access")
-async def set_class_access(
+def set_class_access(
     access_request: AccessRequest,
     current_user: User = Depends(get_current_teacher),
     permission_checker: PermissionChecker = Depends(get_permission_checker),
     db: Session = Depends(get_db)
 ):
     """Set access control for class or individual student."""
-    if not permission_checker.can_access_class(current_user, access_request.class_id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this class"
-        )
-    
-    class_obj = db.query(Class).filter(Class.id == access_request.class_id).first()
-    if not class_obj:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Class not found"
-        )
+    class_obj = _get_accessible_class(permission_checker, current_user, access_request.class_id)
     
     if access_request.action in ["enable_class", "disable_class"]:
         # Class-wide access control
         class_obj.enabled = access_request.enabled
         db.commit()
+        invalidate_class_meta(access_request.class_id)
         
         return {
             "message": f"Class access {'enabled' if access_request.enabled else 'disabled'}",
@@ -231,23 +244,11 @@ async def set_class_access(
                 detail="Student ID required for student access control"
             )
         
-        # Find or create student access record
-        student_access = db.query(StudentAccess).filter(
-            StudentAccess.student_id == access_request.student_id,
-            StudentAccess.class_id == access_request.class_id
-        ).first()
-        
-        if not student_access:
-            student_access = StudentAccess(
-                student_id=access_request.student_id,
-                class_id=access_request.class_id,
-                enabled=access_request.enabled
-            )
-            db.add(student_access)
-        else:
-            student_access.enabled = access_request.enabled
-        
+        _upsert_student_access(
+            db, access_request.student_id, access_request.class_id, access_request.enabled
+        )
         db.commit()
+        invalidate_class_access(access_request.student_id, access_request.class_id)
         
         return {
             "message": f"Student access {'enabled' if access_request.enabled else 'disabled'}",
@@ -263,8 +264,8 @@ async def set_class_access(
         )
 
 
-@router.get("/{class_id}/students", response_model=List[StudentAccessResponse])
-async def list_class_students(
+@router.get("/{class_id}/students", response_model=List[StudentAccessResponse], response_class=ORJSONResponse)
+def list_class_students(
     class_id: str,
     current_user: User = Depends(get_current_teacher),
     permission_checker: PermissionChecker = Depends(get_permission_checker),
@@ -277,25 +278,19 @@ async def list_class_students(
             detail="Access denied to this class"
         )
     
-    # Get all student access records for this class
-    student_access_records = db.query(StudentAccess).filter(
+    # Get all student access records for this class with the student's details
+    rows = db.query(
+        StudentAccess.student_id,
+        User.name.label("student_name"),
+        User.email.label("student_email"),
+        StudentAccess.class_id,
+        StudentAccess.enabled,
+        StudentAccess.daily_question_count,
+        StudentAccess.last_question_date,
+        StudentAccess.created_at,
+        StudentAccess.updated_at
+    ).join(User, User.id == StudentAccess.student_id).filter(
         StudentAccess.class_id == class_id
     ).all()
     
-    response_students = []
-    for access in student_access_records:
-        student = db.query(User).filter(User.id == access.student_id).first()
-        if student:
-            response_students.append(StudentAccessResponse(
-                student_id=student.id,
-                student_name=student.name,
-                student_email=student.email,
-                class_id=access.class_id,
-                enabled=access.enabled,
-                daily_question_count=access.daily_question_count,
-                last_question_date=access.last_question_date,
-                created_at=access.created_at,
-                updated_at=access.updated_at
-            ))
-    
-    return response_students
\ No newline at end of file
+    return [StudentAccessResponse(**row._mapping) for row in rows]
@@ -1,14 +1,19 @@
 """Document management API endpoints."""
 
 import os
-import uuid
+import asyncio
+import secrets
 import logging
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from collections import defaultdict
+from typing import BinaryIO, List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 
-from ..models.database import get_db
-from ..models.models import User, Document, Class
+from ..models.database import SessionLocal, get_db
+from ..models.models import User, Document, Class, class_documents
 from ..schemas.documents import (
     DocumentResponse,
     UploadResponse,
@@ -16,51 +21,150 @@ from ..schemas.documents import (
     ReindexRequest
 )
 from ..auth.dependencies import get_current_teacher, get_permission_checker, PermissionChecker
+from ..services.rag_service import get_rag_service
 from ..utils.validation import ValidationUtils
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Uploaded files are stored here; created at application startup
+DOCUMENTS_DIR = os.getenv("DOCUMENTS_DIR", "data/documents")
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE_MB = 50
+# Documents reindexed at once by a single reindex request
+REINDEX_CONCURRENCY = 8
+
+
+# Validates a whole page of documents in one pydantic-core call
+_DOCUMENT_LIST_ADAPTER = TypeAdapter(List[DocumentResponse])
+
+
+def _load_assigned_class_ids(db: Session, documents: List[Document]) -> None:
+    """Set ``assigned_class_ids`` on each document with one column-only query.
+    
+    DocumentResponse reads these IDs instead of the assigned_classes
+    relationship, so no Class objects are loaded.
+    """
+    assigned_class_ids = defaultdict(list)
+    rows = db.query(class_documents.c.document_id, class_documents.c.class_id).filter(
+        class_documents.c.document_id.in_([document.id for document in documents])
+    ).all()
+    for document_id, class_id in rows:
+        assigned_class_ids[document_id].append(class_id)
+    
+    for document in documents:
+        document.assigned_class_ids = assigned_class_ids[document.id]
+
+
+def _write_upload(source: BinaryIO, file_path: str, max_size: int) -> int:
+    """Copy an upload to disk, returning the bytes read.
+    
+    Stops as soon as the upload exceeds ``max_size``. Called through the
+    threadpool so large writes never block the event loop.
+    """
+    file_size = 0
+    with open(file_path, "wb") as f:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > max_size:
+                break
+            f.write(chunk)
+    return file_size
+
+
+async def _index_document(db: Session, document: Document) -> None:
+    """Index a document with the RAG service, marking it as errored on failure."""
+    try:
+        rag_service = get_rag_service(db)
+        
+        success = await rag_service.index_document(document)
+        
+        if not success:
+            document.status = "error"
+            db.commit()
+    except Exception as e:
+        logger.error(f"Error indexing document: {e}")
+        document.status = "error"
+        db.commit()
+
+
+def _index_document_in_background(document_id: str) -> None:
+    """Index an uploaded document after the response has been sent.
+    
+    Runs in the threadpool with its own session so parsing and embedding
+    never hold the event loop or the request's session.
+    """
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if document:
+            asyncio.run(_index_document(db, document))
+    finally:
+        db.close()
+
+
+def _reindex_document_in_thread(document_id: str) -> bool:
+    """Reindex one document with its own session.
+    
+    Runs in the threadpool so several documents can be parsed and embedded
+    in parallel without sharing the request's session.
+    """
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            return False
+        return asyncio.run(get_rag_service(db).reindex_document(document))
+    finally:
+        db.close()
+
+
+def _delete_document_file(file_path: str) -> None:
+    """Remove a deleted document's file from disk, if it is still there."""
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.exception(f"Error deleting file {file_path}")
+
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     class_id: Optional[str] = Form(None),
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db)
 ):
-    """Upload a new document."""
+    """Upload a new document and queue it for indexing."""
     # Validate file type
     allowed_types = ["pdf", "docx", "pptx", "txt"]
-    if not ValidationUtils.validate_file_type(file.filename, allowed_types):
+    file_extension = ValidationUtils.get_file_extension(file.filename)
+    if file_extension not in allowed_types:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Unsupported file type. Allowed: {', '.join(allowed_types)}"
         )
     
-    # Read file content to check size
-    content = await file.read()
-    file_size = len(content)
+    # Generate document ID and file path
+    document_id = secrets.token_hex(16)
+    file_path = os.path.join(DOCUMENTS_DIR, f"{document_id}.{file_extension}")
+    
+    # Stream file to disk off the event loop, stopping once it exceeds the size limit
+    file_size = await run_in_threadpool(
+        _write_upload, file.file, file_path, MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    )
     
-    if not ValidationUtils.validate_file_size(file_size):
+    if not ValidationUtils.validate_file_size(file_size, MAX_UPLOAD_SIZE_MB):
+        os.remove(file_path)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File too large. Maximum size: 50MB"
+            detail=f"File too large. Maximum size: {MAX_UPLOAD_SIZE_MB}MB"
         )
     
-    # Generate document ID and file path
-    document_id = str(uuid.uuid4())
-    file_extension = file.filename.split(".")[-1].lower()
-    file_path = f"data/documents/{document_id}.{file_extension}"
-    
-    # Ensure documents directory exists
-    os.makedirs("data/documents", exist_ok=True)
-    
-    # Save file to disk
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
     # Create document record
     document = Document(
         id=document_id,
@@ -81,21 +185,8 @@ async def upload_document(
     
     db.commit()
     
-    # Process document with RAG service in background
-    try:
-        from ..services.rag_service import RAGService
-        rag_service = RAGService(db)
-        
-        # Index the document (this would typically be done in a background task)
-        success = await rag_service.index_document(document)
-        
-        if not success:
-            document.status = "error"
-            db.commit()
-    except Exception as e:
-        logger.error(f"Error indexing document: {e}")
-        document.status = "error"
-        db.commit()
+    # Index with the RAG service; poll /{document_id}/status for progress
+    background_tasks.add_task(_index_document_in_background, document_id)
     
     return UploadResponse(
         document_id=document_id,
@@ -106,60 +197,35 @@ async def upload_document(
     )
 
 
-@router.get("/", response_model=List[DocumentResponse])
+@router.get("/", response_model=List[DocumentResponse], response_class=ORJSONResponse)
 async def list_documents(
     class_id: Optional[str] = None,
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db)
 ):
     """List documents accessible to current user."""
-    if current_user.role == "admin":
-        # Admins can see all documents
-        if class_id:
-            class_obj = db.query(Class).filter(Class.id == class_id).first()
-            documents = class_obj.documents if class_obj else []
-        else:
-            documents = db.query(Document).all()
-    else:
-        # Teachers can see documents from their classes
-        if class_id:
-            class_obj = db.query(Class).filter(
-                Class.id == class_id,
+    query = db.query(Document)
+    
+    if class_id:
+        query = query.join(class_documents, class_documents.c.document_id == Document.id).filter(
+            class_documents.c.class_id == class_id
+        )
+        if current_user.role != "admin":
+            # Teachers can only list their own classes
+            query = query.join(Class, Class.id == class_documents.c.class_id).filter(
                 Class.teacher_id == current_user.id
-            ).first()
-            documents = class_obj.documents if class_obj else []
-        else:
-            # Get all documents from teacher's classes
-            teacher_classes = db.query(Class).filter(Class.teacher_id == current_user.id).all()
-            documents = []
-            for class_obj in teacher_classes:
-                documents.extend(class_obj.documents)
-            # Remove duplicates
-            documents = list(set(documents))
-    
-    # Convert to response format
-    response_documents = []
-    for doc in documents:
-        assigned_class_ids = [cls.id for cls in doc.assigned_classes]
-        chunk_count = len(doc.chunks)
-        
-        response_documents.append(DocumentResponse(
-            id=doc.id,
-            name=doc.name,
-            file_path=doc.file_path,
-            file_type=doc.file_type,
-            file_size=doc.file_size,
-            page_count=doc.page_count,
-            author=doc.author,
-            status=doc.status,
-            upload_date=doc.upload_date,
-            last_indexed=doc.last_indexed,
-            metadata=doc.metadata,
-            assigned_classes=assigned_class_ids,
-            chunk_count=chunk_count
-        ))
-    
-    return response_documents
+            )
+    elif current_user.role != "admin":
+        # Teachers can see documents from their classes
+        teacher_document_ids = db.query(class_documents.c.document_id).join(
+            Class, Class.id == class_documents.c.class_id
+        ).filter(Class.teacher_id == current_user.id)
+        query = query.filter(Document.id.in_(teacher_document_ids.scalar_subquery()))
+    
+    documents = query.all()
+    _load_assigned_class_ids(db, documents)
+    
+    return _DOCUMENT_LIST_ADAPTER.validate_python(documents, from_attributes=True)
 
 
 @router.get("/{document_id}", response_model=DocumentResponse)
@@ -183,24 +249,36 @@ async def get_document(
             detail="Document not found"
         )
     
-    assigned_class_ids = [cls.id for cls in document.assigned_classes]
-    chunk_count = len(document.chunks)
-    
-    return DocumentResponse(
-        id=document.id,
-        name=document.name,
-        file_path=document.file_path,
-        file_type=document.file_type,
-        file_size=document.file_size,
-        page_count=document.page_count,
-        author=document.author,
-        status=document.status,
-        upload_date=document.upload_date,
-        last_indexed=document.last_indexed,
-        metadata=document.metadata,
-        assigned_classes=assigned_class_ids,
-        chunk_count=chunk_count
-    )
+    _load_assigned_class_ids(db, [document])
+    return DocumentResponse.model_validate(document)
+
+
+@router.get("/{document_id}/status")
+def get_document_status(
+    document_id: str,
+    current_user: User = Depends(get_current_teacher),
+    permission_checker: PermissionChecker = Depends(get_permission_checker),
+    db: Session = Depends(get_db)
+):
+    """Get the indexing status of a document."""
+    if not permission_checker.can_manage_document(current_user, document_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied to this document"
+        )
+    
+    document = db.query(Document).filter(Document.id == document_id).first()
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    
+    return {
+        "document_id": document.id,
+        "status": document.status,
+        "last_indexed": document.last_indexed
+    }
 
 
 @router.post("/assign")
@@ -268,19 +346,19 @@ async def assign_document_to_classes(
 async def reindex_documents(
     reindex_request: ReindexRequest,
     current_user: User = Depends(get_current_teacher),
+    permission_checker: PermissionChecker = Depends(get_permission_checker),
     db: Session = Depends(get_db)
 ):
     """Trigger document reindexing for RAG pipeline."""
     if reindex_request.document_ids:
-        # Reindex specific documents
-        documents = []
-        for doc_id in reindex_request.document_ids:
-            doc = db.query(Document).filter(Document.id == doc_id).first()
-            if doc:
-                # Check if user can manage this document
-                permission_checker = PermissionChecker(db)
-                if permission_checker.can_manage_document(current_user, doc_id):
-                    documents.append(doc)
+        # Reindex specific documents the user can manage
+        permission_checker.preload_managed_documents(current_user, reindex_request.document_ids)
+        documents = [
+            doc for doc in db.query(Document).filter(
+                Document.id.in_(reindex_request.document_ids)
+            ).all()
+            if permission_checker.can_manage_document(current_user, doc.id)
+        ]
         
         if not documents:
             raise HTTPException(
@@ -294,28 +372,31 @@ async def reindex_documents(
             documents = db.query(Document).all()
         else:
             # Get documents from teacher's classes
-            teacher_classes = db.query(Class).filter(Class.teacher_id == current_user.id).all()
-            documents = []
-            for class_obj in teacher_classes:
-                documents.extend(class_obj.documents)
-            documents = list(set(documents))  # Remove duplicates
-    
-    # Reindex documents using RAG service
-    from ..services.rag_service import RAGService
-    rag_service = RAGService(db)
-    
-    successful_reindex = 0
-    for doc in documents:
-        try:
-            success = await rag_service.reindex_document(doc)
-            if success:
-                successful_reindex += 1
-        except Exception as e:
-            logger.error(f"Error reindexing document {doc.name}: {e}")
-            doc.status = "error"
+            documents = db.query(Document).join(Document.assigned_classes).filter(
+                Class.teacher_id == current_user.id
+            ).distinct().all()
+    
+    # Reindex documents using RAG service, a bounded number at a time
+    semaphore = asyncio.Semaphore(REINDEX_CONCURRENCY)
+    
+    async def reindex_one(doc: Document) -> Optional[bool]:
+        async with semaphore:
+            try:
+                return await run_in_threadpool(_reindex_document_in_thread, doc.id)
+            except Exception as e:
+                logger.error(f"Error reindexing document {doc.name}: {e}")
+                return None
+    
+    results = await asyncio.gather(*(reindex_one(doc) for doc in documents))
     
+    # Record failures on the request's session once every task has finished
+    for doc, success in zip(documents, results):
+        if success is None:
+            doc.status = "error"
     db.commit()
     
+    successful_reindex = sum(1 for success in results if success)
+    
     return {
         "message": f"Reindexing completed for {successful_reindex}/{len(documents)} documents",
         "document_count": len(documents),
@@ -328,6 +409,7 @@ async def reindex_documents(
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: str,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_teacher),
     permission_checker: PermissionChecker = Depends(get_permission_checker),
     db: Session = Depends(get_db)
@@ -346,18 +428,13 @@ async def delete_document(
             detail="Document not found"
         )
     
-    # Delete file from disk
-    try:
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-    except Exception as e:
-        # Log error but continue with database deletion
-        print(f"Error deleting file {document.file_path}: {e}")
-    
     # Delete from database (cascades to chunks and class assignments)
     db.delete(document)
     db.commit()
     
+    # Remove the file once the response has been sent
+    background_tasks.add_task(_delete_document_file, document.file_path)
+    
     return {
         "message": "Document deleted successfully",
         "document_id": document_id,
@@ -2,10 +2,11 @@
 
 from typing import List, Dict, Any
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
 from ..models.database import get_db
-from ..models.models import User, Class
+from ..models.models import User
 from ..services.class_isolation_service import ClassIsolationService
 from ..auth.dependencies import get_current_teacher, get_current_admin, get_permission_checker, PermissionChecker
 
@@ -119,7 +120,7 @@ async def remove_document_from_class(
     }
 
 
-@router.get("/classes/{class_id}/documents")
+@router.get("/classes/{class_id}/documents", response_class=ORJSONResponse)
 async def get_class_documents(
     class_id: str,
     current_user: User = Depends(get_current_teacher),
@@ -190,7 +191,6 @@ async def get_student_classes(
         # Verify student is in one of teacher's classes
         isolation_service = ClassIsolationService(db)
         student_classes = isolation_service.get_student_classes(student_id)
-        teacher_classes = current_user.taught_classes
         
         # Filter to only classes taught by this teacher
         accessible_classes = [
@@ -281,6 +281,7 @@ async def bulk_assign_documents(
         )
     
     # Verify user can manage all documents
+    permission_checker.preload_managed_documents(current_user, document_ids)
     for doc_id in document_ids:
         if not permission_checker.can_manage_document(current_user, doc_id):
             raise HTTPException(
@@ -344,7 +345,7 @@ async def cleanup_orphaned_data(
     }
 
 
-@router.get("/isolation/system-audit")
+@router.get("/isolation/system-audit", response_class=ORJSONResponse)
 async def system_isolation_audit(
     current_user: User = Depends(get_current_admin),
     db: Session = Depends(get_db)
@@ -352,16 +353,11 @@ async def system_isolation_audit(
     """Comprehensive system audit for isolation integrity (admin only)."""
     isolation_service = ClassIsolationService(db)
     
-    # Get all classes
-    all_classes = db.query(Class).all()
-    audit_results = []
-    
-    for class_obj in all_classes:
-        class_audit = isolation_service.audit_class_isolation(class_obj.id)
-        audit_results.append(class_audit)
+    # Audit all classes from bulk-loaded assignments and enrollments
+    audit_results = isolation_service.audit_all_classes()
     
     # Summary statistics
-    total_classes = len(all_classes)
+    total_classes = len(audit_results)
     secure_classes = len([audit for audit in audit_results if audit.get("isolation_status") == "SECURE"])
     warning_classes = len([audit for audit in audit_results if audit.get("isolation_status") == "WARNING"])
     
@@ -1,11 +1,15 @@
 """Audit logging API endpoints."""
 
 import csv
+import hashlib
 import io
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc
+from datetime import datetime
+from operator import attrgetter
+from typing import Callable, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy import and_, case, desc, distinct, func, select
 
 from ..models.database import get_db
 from ..models.models import User, AuditLog, Class
@@ -15,9 +19,74 @@ from ..auth.dependencies import get_current_teacher, get_permission_checker, Per
 
 router = APIRouter()
 
+# Relationships used when rendering log rows, limited to the columns AuditLogResponse
+# reads; anything else raises instead of lazy loading
+_AUDIT_LOG_LOAD_OPTIONS = (
+    selectinload(AuditLog.student).load_only(User.name, User.email),
+    selectinload(AuditLog.class_).load_only(Class.name),
+    raiseload("*"),
+)
+
+
+def _parse_iso(value: str, field: str) -> datetime:
+    """Parse an ISO 8601 query parameter or reject the request with a 400."""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {field} format. Use ISO format."
+        )
+
+
+def _sanitize_query_text(query_text: Optional[str]) -> str:
+    """Flatten query text onto one CSV line."""
+    return query_text.replace('\n', ' ').replace('\r', '') if query_text else ""
+
+
+def _unknown_if_missing(value):
+    """Show a missing student or class as Unknown."""
+    return value or "Unknown"
+
+
+def _blank_if_missing(value):
+    """Leave a missing optional value empty."""
+    return value or ""
+
+
+# Formatting for exported columns that are not written as selected
+_CSV_FORMATTERS = {
+    "timestamp": datetime.isoformat,
+    "student_email": _unknown_if_missing,
+    "class_name": _unknown_if_missing,
+    "query_text": _sanitize_query_text,
+    "error_message": _blank_if_missing,
+    "confidence_score": _blank_if_missing,
+}
+
+
+def _csv_row_emitter(writerow: Callable, columns: List[str]) -> Callable:
+    """Return a CSV row writer for the given export columns.
+    
+    The columns are fixed for a request, so the getter and formatters are
+    resolved once rather than per row.
+    """
+    get_values = attrgetter(*columns)
+    formatters = [_CSV_FORMATTERS.get(column) for column in columns]
+    
+    def emit(log):
+        writerow([
+            value if format_value is None else format_value(value)
+            for format_value, value in zip(formatters, get_values(log))
+        ])
+    
+    return emit
+
 
 @router.get("/", response_model=List[AuditLogResponse])
 async def get_audit_logs(
+    request: Request,
+    response: Response,
     class_id: str = None,
     student_id: str = None,
     from_date: str = None,
@@ -30,12 +99,13 @@ async def get_audit_logs(
     db: Session = Depends(get_db)
 ):
     """Get audit logs with filtering options."""
-    # Build query
-    query = db.query(AuditLog).join(User, AuditLog.student_id == User.id).join(Class, AuditLog.class_id == Class.id)
+    # Build query; every filter is on AuditLog columns, so students and classes
+    # come from the eager loads rather than joins
+    query = db.query(AuditLog)
     
-    # Filter by teacher's classes if not admin
+    # Filter by teacher's classes if not admin (as a subquery, without loading them)
     if current_user.role != "admin":
-        teacher_class_ids = [cls.id for cls in current_user.taught_classes]
+        teacher_class_ids = select(Class.id).where(Class.teacher_id == current_user.id).scalar_subquery()
         query = query.filter(AuditLog.class_id.in_(teacher_class_ids))
     
     # Apply filters
@@ -50,41 +120,43 @@ async def get_audit_logs(
     if student_id:
         query = query.filter(AuditLog.student_id == student_id)
     
-    if from_date:
-        try:
-            from datetime import datetime
-            from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp >= from_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid from_date format. Use ISO format."
-            )
+    from_dt = _parse_iso(from_date, "from_date") if from_date else None
+    if from_dt:
+        query = query.filter(AuditLog.timestamp >= from_dt)
     
-    if to_date:
-        try:
-            from datetime import datetime
-            to_dt = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp <= to_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid to_date format. Use ISO format."
-            )
+    to_dt = _parse_iso(to_date, "to_date") if to_date else None
+    if to_dt:
+        query = query.filter(AuditLog.timestamp <= to_dt)
     
     if success_only is not None:
         query = query.filter(AuditLog.success == success_only)
     
+    # Logs are append-only, so the newest timestamp and row count identify the
+    # filtered window; the page and filters are part of the key because they
+    # select different rows from it. Unchanged pages are answered without
+    # loading any rows
+    latest, count = query.with_entities(func.max(AuditLog.timestamp), func.count(AuditLog.id)).one()
+    etag_key = (
+        current_user.id, latest, count, offset, limit,
+        class_id, student_id, from_dt, to_dt, success_only,
+    )
+    etag = '"{}"'.format(hashlib.blake2b(
+        ":".join(map(str, etag_key)).encode(), digest_size=8
+    ).hexdigest())
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
     # Order by timestamp (newest first) and apply pagination
-    query = query.order_by(desc(AuditLog.timestamp)).offset(offset).limit(limit)
+    query = query.options(*_AUDIT_LOG_LOAD_OPTIONS).order_by(desc(AuditLog.timestamp)).offset(offset).limit(limit)
     
     logs = query.all()
     
     # Convert to response format
     response_logs = []
     for log in logs:
-        student = db.query(User).filter(User.id == log.student_id).first()
-        class_obj = db.query(Class).filter(Class.id == log.class_id).first()
+        student = log.student
+        class_obj = log.class_
         
         response_logs.append(AuditLogResponse(
             id=log.id,
@@ -115,13 +187,13 @@ async def get_logs_summary(
     db: Session = Depends(get_db)
 ):
     """Get summary statistics for audit logs."""
-    # Build base query
-    query = db.query(AuditLog)
+    # Collect filters shared by the aggregate queries below
+    filters = []
     
-    # Filter by teacher's classes if not admin
+    # Filter by teacher's classes if not admin (as a subquery, without loading them)
     if current_user.role != "admin":
-        teacher_class_ids = [cls.id for cls in current_user.taught_classes]
-        query = query.filter(AuditLog.class_id.in_(teacher_class_ids))
+        teacher_class_ids = select(Class.id).where(Class.teacher_id == current_user.id).scalar_subquery()
+        filters.append(AuditLog.class_id.in_(teacher_class_ids))
     
     # Apply filters
     if class_id:
@@ -130,34 +202,25 @@ async def get_logs_summary(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Access denied to logs for this class"
             )
-        query = query.filter(AuditLog.class_id == class_id)
+        filters.append(AuditLog.class_id == class_id)
     
     if from_date:
-        try:
-            from datetime import datetime
-            from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp >= from_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid from_date format"
-            )
+        filters.append(AuditLog.timestamp >= _parse_iso(from_date, "from_date"))
     
     if to_date:
-        try:
-            from datetime import datetime
-            to_dt = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp <= to_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid to_date format"
-            )
-    
-    # Get all logs for analysis
-    logs = query.all()
-    
-    if not logs:
+        filters.append(AuditLog.timestamp <= _parse_iso(to_date, "to_date"))
+    
+    # Aggregate in the database instead of loading every log row
+    total_queries, successful_queries, average_response_time, unique_students, first_timestamp, last_timestamp = db.query(
+        func.count(AuditLog.id),
+        func.sum(case((AuditLog.success, 1), else_=0)),
+        func.avg(case((AuditLog.response_time_ms > 0, AuditLog.response_time_ms))),
+        func.count(distinct(AuditLog.student_id)),
+        func.min(AuditLog.timestamp),
+        func.max(AuditLog.timestamp)
+    ).filter(*filters).one()
+    
+    if not total_queries:
         return LogSummaryResponse(
             total_queries=0,
             successful_queries=0,
@@ -168,42 +231,35 @@ async def get_logs_summary(
             top_error_types=[]
         )
     
-    # Calculate statistics
-    total_queries = len(logs)
-    successful_queries = sum(1 for log in logs if log.success)
+    successful_queries = int(successful_queries or 0)
     failed_queries = total_queries - successful_queries
-    unique_students = len(set(log.student_id for log in logs))
-    
-    # Average response time
-    response_times = [log.response_time_ms for log in logs if log.response_time_ms > 0]
-    average_response_time = sum(response_times) / len(response_times) if response_times else 0.0
+    average_response_time = float(average_response_time) if average_response_time is not None else 0.0
     
     # Date range
-    timestamps = [log.timestamp for log in logs]
     date_range = {
-        "start": min(timestamps).isoformat() if timestamps else None,
-        "end": max(timestamps).isoformat() if timestamps else None
+        "start": first_timestamp.isoformat() if first_timestamp else None,
+        "end": last_timestamp.isoformat() if last_timestamp else None
     }
     
     # Most active class
     if current_user.role == "admin":
-        from collections import Counter
-        class_counts = Counter(log.class_id for log in logs)
-        most_active_class_id = class_counts.most_common(1)[0][0] if class_counts else None
-        most_active_class = None
-        if most_active_class_id:
-            class_obj = db.query(Class).filter(Class.id == most_active_class_id).first()
-            most_active_class = class_obj.name if class_obj else most_active_class_id
+        most_active = db.query(AuditLog.class_id, Class.name).outerjoin(
+            Class, AuditLog.class_id == Class.id
+        ).filter(*filters).group_by(AuditLog.class_id, Class.name).order_by(
+            func.count(AuditLog.id).desc()
+        ).first()
+        most_active_class = (most_active.name or most_active.class_id) if most_active else None
     else:
         most_active_class = None
     
     # Top error types
-    error_logs = [log for log in logs if not log.success and log.error_message]
-    from collections import Counter
-    error_counter = Counter(log.error_message for log in error_logs)
+    error_count = func.count(AuditLog.id)
+    error_rows = db.query(AuditLog.error_message, error_count).filter(
+        *filters, AuditLog.success.is_(False), AuditLog.error_message.isnot(None), AuditLog.error_message != ""
+    ).group_by(AuditLog.error_message).order_by(error_count.desc()).limit(5).all()
     top_error_types = [
         {"error": error, "count": count}
-        for error, count in error_counter.most_common(5)
+        for error, count in error_rows
     ]
     
     return LogSummaryResponse(
@@ -231,12 +287,22 @@ async def export_logs_csv(
     db: Session = Depends(get_db)
 ):
     """Export audit logs as CSV file."""
-    # Get logs using same filtering logic as get_audit_logs
-    query = db.query(AuditLog).join(User, AuditLog.student_id == User.id).join(Class, AuditLog.class_id == Class.id)
-    
-    # Filter by teacher's classes if not admin
+    # Get logs using same filtering logic as get_audit_logs, selecting only exported columns
+    query = select(
+        AuditLog.timestamp,
+        User.email.label("student_email"),
+        Class.name.label("class_name"),
+        AuditLog.success,
+        AuditLog.response_time_ms,
+        AuditLog.citation_count,
+        AuditLog.query_text,
+        AuditLog.error_message,
+        AuditLog.confidence_score
+    ).join(User, AuditLog.student_id == User.id).join(Class, AuditLog.class_id == Class.id)
+    
+    # Filter by teacher's classes if not admin (as a subquery, without loading them)
     if current_user.role != "admin":
-        teacher_class_ids = [cls.id for cls in current_user.taught_classes]
+        teacher_class_ids = select(Class.id).where(Class.teacher_id == current_user.id).scalar_subquery()
         query = query.filter(AuditLog.class_id.in_(teacher_class_ids))
     
     # Apply filters (same as get_audit_logs)
@@ -252,34 +318,15 @@ async def export_logs_csv(
         query = query.filter(AuditLog.student_id == student_id)
     
     if from_date:
-        try:
-            from datetime import datetime
-            from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp >= from_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid from_date format"
-            )
+        query = query.filter(AuditLog.timestamp >= _parse_iso(from_date, "from_date"))
     
     if to_date:
-        try:
-            from datetime import datetime
-            to_dt = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
-            query = query.filter(AuditLog.timestamp <= to_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid to_date format"
-            )
+        query = query.filter(AuditLog.timestamp <= _parse_iso(to_date, "to_date"))
     
     # Order by timestamp and limit to reasonable size
-    logs = query.order_by(desc(AuditLog.timestamp)).limit(10000).all()
+    query = query.order_by(desc(AuditLog.timestamp)).limit(10000)
     
-    # Create CSV content
-    output = io.StringIO()
-    
-    # Define CSV headers based on options
+    # Define CSV headers based on options; they double as the selected column labels
     headers = [
         "timestamp", "student_email", "class_name", "success", 
         "response_time_ms", "citation_count"
@@ -291,44 +338,25 @@ async def export_logs_csv(
     if include_error_details:
         headers.extend(["error_message", "confidence_score"])
     
-    writer = csv.writer(output)
-    writer.writerow(headers)
-    
-    # Write data rows
-    for log in logs:
-        student = db.query(User).filter(User.id == log.student_id).first()
-        class_obj = db.query(Class).filter(Class.id == log.class_id).first()
+    def generate_csv():
+        # Reuse one small buffer and emit each row as soon as it is formatted
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(headers)
+        yield output.getvalue()
         
-        row = [
-            log.timestamp.isoformat(),
-            student.email if student else "Unknown",
-            class_obj.name if class_obj else "Unknown",
-            log.success,
-            log.response_time_ms,
-            log.citation_count
-        ]
-        
-        if include_query_text:
-            # Sanitize query text for CSV
-            query_text = log.query_text.replace('\n', ' ').replace('\r', '') if log.query_text else ""
-            row.append(query_text)
-        
-        if include_error_details:
-            row.extend([
-                log.error_message or "",
-                log.confidence_score or ""
-            ])
-        
-        writer.writerow(row)
-    
-    # Return CSV as response
-    csv_content = output.getvalue()
-    output.close()
-    
-    return Response(
-        content=csv_content,
+        # Fetch rows in batches rather than materializing the whole result
+        emit = _csv_row_emitter(writer.writerow, headers)
+        for log in db.execute(query.execution_options(yield_per=1000)):
+            output.seek(0)
+            output.truncate(0)
+            emit(log)
+            yield output.getvalue()
+    
+    return StreamingResponse(
+        generate_csv(),
         media_type="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename=audit_logs_{class_id or 'all'}_{from_date or 'all'}.csv"
         }
-    )
\ No newline at end of file
+    )
@@ -4,18 +4,41 @@ import time
 from datetime import datetime, date
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import Select, and_, case, func, or_, select, update
 from sqlalchemy.orm import Session
 
 from ..models.database import get_db
 from ..models.models import User, Class, StudentAccess, AuditLog
 from ..schemas.queries import QueryRequest, QueryResponse, PermissionCheckResponse
 from ..auth.dependencies import get_current_user
+from ..services.rag_service import get_rag_service
+from ..services.audit_log_writer import audit_log_writer
 from ..utils.validation import validate_query_request
 
 
 router = APIRouter()
 
 
+def _class_with_access(class_id: str, student_id: str) -> Select:
+    """Select a class together with the student's access record, if any."""
+    return select(Class, StudentAccess).outerjoin(
+        StudentAccess,
+        and_(StudentAccess.class_id == Class.id, StudentAccess.student_id == student_id)
+    ).where(Class.id == class_id)
+
+
+def _release_question(db: Session, student_access_id: int) -> None:
+    """Give back a question reserved for a request that was not answered."""
+    db.rollback()
+    db.execute(
+        update(StudentAccess)
+        .where(StudentAccess.id == student_access_id, StudentAccess.daily_question_count > 0)
+        .values(daily_question_count=StudentAccess.daily_question_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
 @router.post("/", response_model=QueryResponse)
 async def query_documents(
     query_request: QueryRequest,
@@ -32,13 +55,14 @@ async def query_documents(
             detail="User ID mismatch"
         )
     
-    # Get class and check access
-    class_obj = db.query(Class).filter(Class.id == query_request.class_id).first()
-    if not class_obj:
+    # Get class and the student's access record in one query
+    row = db.execute(_class_with_access(query_request.class_id, current_user.id)).first()
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Class not found"
         )
+    class_obj, student_access = row
     
     # Check if class is enabled
     if not class_obj.enabled:
@@ -49,11 +73,6 @@ async def query_documents(
         )
     
     # Check student access
-    student_access = db.query(StudentAccess).filter(
-        StudentAccess.student_id == current_user.id,
-        StudentAccess.class_id == query_request.class_id
-    ).first()
-    
     if not student_access or not student_access.enabled:
         await log_query_attempt(db, query_request, False, "Student access disabled", 0)
         raise HTTPException(
@@ -61,25 +80,44 @@ async def query_documents(
             detail="Access disabled by your teacher"
         )
     
-    # Check daily question limit
+    # Reserve a question against the daily limit in one atomic UPDATE, resetting
+    # the counter on the first question of a new day
     today = date.today()
-    if (student_access.last_question_date and 
-        student_access.last_question_date.date() == today):
-        if student_access.daily_question_count >= class_obj.daily_question_limit:
-            await log_query_attempt(db, query_request, False, "Daily limit exceeded", 0)
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Daily question limit ({class_obj.daily_question_limit}) exceeded"
+    asked_today = func.date(StudentAccess.last_question_date) == today
+    question_count = db.execute(
+        update(StudentAccess)
+        .where(
+            StudentAccess.id == student_access.id,
+            StudentAccess.enabled.is_(True),
+            or_(
+                StudentAccess.last_question_date.is_(None),
+                ~asked_today,
+                StudentAccess.daily_question_count < class_obj.daily_question_limit
             )
-    else:
-        # Reset counter for new day
-        student_access.daily_question_count = 0
-        student_access.last_question_date = datetime.utcnow()
+        )
+        .values(
+            daily_question_count=case((asked_today, StudentAccess.daily_question_count + 1), else_=1),
+            last_question_date=datetime.utcnow()
+        )
+        .returning(StudentAccess.daily_question_count)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    
+    if question_count is None:
+        await log_query_attempt(db, query_request, False, "Daily limit exceeded", 0)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Daily question limit ({class_obj.daily_question_limit}) exceeded"
+        )
+    
+    # Commit right away so the row (and SQLite's write lock) is not held during the RAG call
+    db.commit()
     
     # Validate query
     validation_result = validate_query_request(query_request, class_obj.blocked_terms)
     if not validation_result["valid"]:
         error_msg = "; ".join(validation_result["errors"])
+        _release_question(db, student_access.id)
         await log_query_attempt(db, query_request, False, error_msg, 0)
         
         if validation_result["blocked_term"]:
@@ -97,31 +135,31 @@ async def query_documents(
     sanitized_query = validation_result["sanitized_query"]
     
     # Process query using RAG service
-    from ..services.rag_service import RAGService
-    rag_service = RAGService(db)
+    rag_service = get_rag_service(db)
     
-    rag_response = await rag_service.process_query(
-        query=sanitized_query,
-        class_id=query_request.class_id,
-        student_id=current_user.id
-    )
+    try:
+        rag_response = await rag_service.process_query(
+            query=sanitized_query,
+            class_id=query_request.class_id,
+            student_id=current_user.id
+        )
+    except Exception:
+        # A request that never produced an answer does not use up a question
+        _release_question(db, student_access.id)
+        raise
     
     # Add remaining questions count
-    rag_response.remaining_questions = class_obj.daily_question_limit - student_access.daily_question_count - 1
-    
-    # Update question count
-    student_access.daily_question_count += 1
-    student_access.last_question_date = datetime.utcnow()
-    db.commit()
+    rag_response.remaining_questions = class_obj.daily_question_limit - question_count
     
     # Log query attempt
-    await log_query_attempt(
-        db, query_request, rag_response.success, 
+    db.add(AuditLog(**build_audit_log_row(
+        query_request, rag_response.success, 
         rag_response.error if not rag_response.success else "Success", 
         rag_response.processing_time,
         confidence=rag_response.confidence,
         citation_count=len(rag_response.citations)
-    )
+    )))
+    db.commit()
     
     return rag_response
 
@@ -133,19 +171,14 @@ async def check_query_permission(
     db: Session = Depends(get_db)
 ):
     """Check if user can query a specific class."""
-    # Get class
-    class_obj = db.query(Class).filter(Class.id == class_id).first()
-    if not class_obj:
+    # Get class and the user's access record in one query
+    row = db.execute(_class_with_access(class_id, current_user.id)).first()
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Class not found"
         )
-    
-    # Check student access
-    student_access = db.query(StudentAccess).filter(
-        StudentAccess.student_id == current_user.id,
-        StudentAccess.class_id == class_id
-    ).first()
+    class_obj, student_access = row
     
     class_enabled = class_obj.enabled
     student_enabled = student_access.enabled if student_access else False
@@ -182,6 +215,28 @@ async def check_query_permission(
     )
 
 
+def build_audit_log_row(
+    query_request: QueryRequest,
+    success: bool,
+    error_message: str = None,
+    response_time_ms: int = 0,
+    confidence: float = None,
+    citation_count: int = 0
+) -> dict:
+    """Build audit log column values for a query attempt."""
+    return {
+        "student_id": query_request.student_id,
+        "class_id": query_request.class_id,
+        "query_text": query_request.query[:500],  # Truncate for storage
+        "response_time_ms": response_time_ms,
+        "success": success,
+        "citation_count": citation_count,
+        "confidence_score": confidence,
+        "error_message": error_message,
+        "timestamp": datetime.utcnow()
+    }
+
+
 async def log_query_attempt(
     db: Session,
     query_request: QueryRequest,
@@ -192,17 +247,14 @@ async def log_query_attempt(
     citation_count: int = 0
 ):
     """Log query attempt for audit purposes."""
-    audit_log = AuditLog(
-        student_id=query_request.student_id,
-        class_id=query_request.class_id,
-        query_text=query_request.query[:500],  # Truncate for storage
-        response_time_ms=response_time_ms,
-        success=success,
-        citation_count=citation_count,
-        confidence_score=confidence,
-        error_message=error_message,
-        timestamp=datetime.utcnow()
+    row = build_audit_log_row(
+        query_request, success, error_message, response_time_ms,
+        confidence=confidence, citation_count=citation_count
     )
     
-    db.add(audit_log)
-    db.commit()
\ No newline at end of file
+    # Batched off the request path when the background writer is running
+    if audit_log_writer.enqueue(row):
+        return
+    
+    db.add(AuditLog(**row))
+    db.commit()
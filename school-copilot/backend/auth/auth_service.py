@@ -1,15 +1,85 @@
 """Authentication service for user management."""
 
+import hashlib
+import hmac
+import logging
+import threading
 import uuid
-from datetime import datetime, timedelta
-from typing import Optional, List
+from datetime import datetime
+from typing import Any, Dict, Optional, List
+from cachetools import TTLCache
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..models.database import SessionLocal
 from ..models.models import User
 from ..schemas.auth import LoginRequest, AuthResponse, UserInfo
 from ..utils.validation import ValidationUtils
 from .jwt_handler import jwt_handler
 
+logger = logging.getLogger(__name__)
+
+
+# Role hierarchy as nested bitmasks: admin > teacher > student
+_ROLE_MASKS = {
+    "student": 0b001,
+    "teacher": 0b011,
+    "admin": 0b111,
+}
+
+
+def role_mask(role: str) -> int:
+    """Return the permission bitmask of a role (0 for unknown roles)."""
+    return _ROLE_MASKS.get(role, 0)
+
+
+def role_satisfies(user_role: str, required_role: str) -> bool:
+    """Check whether a role includes every permission of the required role."""
+    required_mask = role_mask(required_role)
+    return role_mask(user_role) & required_mask == required_mask
+
+
+# Recently verified logins, keyed by an HMAC of (user, stored hash, password).
+# Repeat logins skip the password KDF; raw passwords are never stored.
+_verified_logins: TTLCache = TTLCache(maxsize=2048, ttl=60)
+_verified_logins_lock = threading.Lock()
+
+
+def _login_cache_key(user: User, password: str) -> bytes:
+    """Derive the cache key for a user/password pair."""
+    message = f"{user.id}:{user.hashed_password}:{password}".encode()
+    return hmac.new(jwt_handler.secret_key.encode(), message, hashlib.sha256).digest()
+
+
+# Users whose activity timestamp was written recently; further updates within
+# the TTL are skipped so authenticated requests don't each write to the users table
+_recent_activity: TTLCache = TTLCache(maxsize=10000, ttl=60)
+_recent_activity_lock = threading.Lock()
+
+
+def claim_activity_update(user_id: str) -> bool:
+    """Reserve the next activity write for a user; False if one ran within the TTL."""
+    with _recent_activity_lock:
+        if user_id in _recent_activity:
+            return False
+        _recent_activity[user_id] = True
+        return True
+
+
+def record_user_activity(user_id: str) -> None:
+    """Write a user's activity timestamp in its own session (for background tasks)."""
+    with SessionLocal() as db:
+        try:
+            db.execute(
+                update(User).where(User.id == user_id).values(last_login=datetime.utcnow())
+            )
+            db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            logger.exception("Failed to record activity for user %s", user_id)
+
 
 class AuthService:
     """Service for handling authentication operations."""
@@ -33,7 +103,8 @@ class AuthService:
         # For now, we'll use placeholder authentication
         # In production, this would integrate with SSO or verify password
         if login_request.password:
-            if not jwt_handler.verify_password(login_request.password, user.hashed_password or ""):
+            # Password hashing is CPU-bound; keep it off the event loop
+            if not await run_in_threadpool(self._verify_user_password, user, login_request.password):
                 return None
         
         # Update last login
@@ -42,7 +113,7 @@ class AuthService:
         
         # Create token
         token = jwt_handler.create_user_token(user)
-        expires_at = datetime.utcnow() + timedelta(minutes=jwt_handler.access_token_expire_minutes)
+        expires_at = datetime.utcnow() + jwt_handler.access_token_expires
         
         return AuthResponse(
             token=token,
@@ -59,6 +130,25 @@ class AuthService:
             expires_at=expires_at
         )
     
+    def _verify_user_password(self, user: User, password: str) -> bool:
+        """Verify a login password, reusing a recent successful verification."""
+        with _verified_logins_lock:
+            if _login_cache_key(user, password) in _verified_logins:
+                return True
+        
+        verified, new_hash = jwt_handler.verify_and_update_password(
+            password, user.hashed_password or ""
+        )
+        if not verified:
+            return False
+        if new_hash:
+            # Re-hash legacy bcrypt passwords with the current scheme
+            user.hashed_password = new_hash
+        
+        with _verified_logins_lock:
+            _verified_logins[_login_cache_key(user, password)] = True
+        return True
+    
     def create_user(self, email: str, name: str, role: str, password: Optional[str] = None) -> User:
         """Create new user."""
         user_id = str(uuid.uuid4())
@@ -93,10 +183,13 @@ class AuthService:
     
     def update_user_activity(self, user_id: str) -> None:
         """Update user's last activity timestamp."""
-        user = self.get_user_by_id(user_id)
-        if user:
-            user.last_login = datetime.utcnow()
-            self.db.commit()
+        if not claim_activity_update(user_id):
+            return
+        
+        self.db.execute(
+            update(User).where(User.id == user_id).values(last_login=datetime.utcnow())
+        )
+        self.db.commit()
     
     def deactivate_user(self, user_id: str) -> bool:
         """Deactivate user account."""
@@ -113,47 +206,53 @@ class AuthService:
         if not user or not user.is_active:
             return False
         
-        # Role hierarchy: admin > teacher > student
-        role_hierarchy = {
-            "admin": 3,
-            "teacher": 2,
-            "student": 1
-        }
-        
-        user_level = role_hierarchy.get(user.role, 0)
-        required_level = role_hierarchy.get(required_role, 0)
-        
-        return user_level >= required_level
+        return role_satisfies(user.role, required_role)
     
     def get_users_by_role(self, role: str) -> List[User]:
         """Get all users with specific role."""
         return self.db.query(User).filter(User.role == role, User.is_active == True).all()
     
+    def get_user_summaries_by_role(self, role: str) -> List[Dict[str, Any]]:
+        """Get public fields of active users with a role, without loading ORM objects."""
+        rows = self.db.execute(
+            select(
+                User.id,
+                User.email,
+                User.name,
+                User.is_active,
+                User.created_at,
+                User.last_login
+            ).where(User.role == role, User.is_active == True)
+        ).all()
+        return [dict(row._mapping) for row in rows]
+    
     def create_demo_users(self) -> None:
         """Create demo users for development/testing."""
-        # Create demo teacher
-        if not self.get_user_by_email("teacher@example.edu"):
-            self.create_user(
-                email="teacher@example.edu",
-                name="Demo Teacher",
-                role="teacher",
-                password="demo123"
-            )
+        demo_users = [
+            ("teacher@example.edu", "Demo Teacher", "teacher", "demo123"),
+            ("student@example.edu", "Demo Student", "student", "demo123"),
+            ("admin@example.edu", "Demo Admin", "admin", "admin123"),
+        ]
         
-        # Create demo student
-        if not self.get_user_by_email("student@example.edu"):
-            self.create_user(
-                email="student@example.edu",
-                name="Demo Student",
-                role="student",
-                password="demo123"
-            )
+        # One lookup for the accounts that already exist
+        existing = set(self.db.scalars(
+            select(User.email).where(User.email.in_([email for email, _, _, _ in demo_users]))
+        ))
         
-        # Create demo admin
-        if not self.get_user_by_email("admin@example.edu"):
-            self.create_user(
-                email="admin@example.edu",
-                name="Demo Admin",
-                role="admin",
-                password="admin123"
-            )
\ No newline at end of file
+        # Insert the missing ones in a single statement
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "email": email,
+                "name": name,
+                "role": role,
+                "hashed_password": jwt_handler.hash_password(password),
+                "is_active": True,
+                "created_at": datetime.utcnow(),
+            }
+            for email, name, role, password in demo_users
+            if email not in existing
+        ]
+        if rows:
+            self.db.execute(insert(User), rows)
+            self.db.commit()
@@ -1,24 +1,171 @@
 """FastAPI dependencies for authentication and authorization."""
 
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+import hashlib
+import itertools
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional, Set, Tuple
+from cachetools import TTLCache
+from fastapi import BackgroundTasks, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import event, exists, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 from ..models.database import get_db
-from ..models.models import User
+from ..models.models import Class, StudentAccess, User, class_documents
 from ..schemas.auth import TokenData
-from .jwt_handler import verify_token
-from .auth_service import AuthService
+from .jwt_handler import verify_token, jwt_handler
+from .auth_service import AuthService, claim_activity_update, record_user_activity, role_mask
 
 
 # Security scheme for JWT tokens
 security = HTTPBearer()
 
+# Verified tokens: token hash -> (token data, detached user snapshot)
+token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+# Tokens revoked by logout stay rejected until they would have expired anyway
+revoked_tokens: TTLCache = TTLCache(
+    maxsize=10000, ttl=jwt_handler.access_token_expire_minutes * 60
+)
+# Users whose cached entries must be bypassed (outlives any token_cache entry)
+revoked_users: TTLCache = TTLCache(maxsize=10000, ttl=30)
+_cache_lock = threading.Lock()
+
+# Class access decisions: (user id, class id, role) -> bool
+_access_cache: TTLCache = TTLCache(maxsize=50000, ttl=60)
+_access_cache_lock = threading.Lock()
+
+# Clients may reuse token validation results for as long as the server caches them
+TOKEN_CACHE_CONTROL = "private, max-age=30"
+
+
+def hash_token(token: str) -> str:
+    """Return the cache key for a bearer token (never store the raw token)."""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def invalidate_token(token_hash: str, revoke: bool = False) -> None:
+    """Drop a token from the verification cache, optionally revoking it."""
+    with _cache_lock:
+        token_cache.pop(token_hash, None)
+        if revoke:
+            revoked_tokens[token_hash] = True
+
+
+def invalidate_user(user_id: str) -> None:
+    """Force the next request of a user to be re-validated against the database."""
+    with _cache_lock:
+        revoked_users[user_id] = True
+
+
+def invalidate_class_access(user_id: Optional[str], class_id: str) -> None:
+    """Drop cached class access decisions after an enrollment change.
+    
+    A user_id of None drops the decisions of every user for the class.
+    """
+    with _access_cache_lock:
+        if user_id is None:
+            for key in [key for key in _access_cache if key[1] == class_id]:
+                _access_cache.pop(key, None)
+            return
+        for role in ("teacher", "student"):
+            _access_cache.pop((user_id, class_id, role), None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_class_access_changes(session: Session, flush_context) -> None:
+    """Remember which cached access decisions an ORM flush may have changed."""
+    changed = session.info.setdefault("class_access_changes", set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, StudentAccess):
+            changed.add((obj.student_id, obj.class_id))
+        elif isinstance(obj, Class) and (
+            obj in session.deleted or inspect(obj).attrs.teacher_id.history.has_changes()
+        ):
+            # The previous teacher is not known once the instance has expired
+            changed.add((None, obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_class_access(session: Session) -> None:
+    """Invalidate decisions once the changes are visible to other sessions.
+    
+    Core statements bypass the ORM, so their callers invalidate explicitly.
+    """
+    for user_id, class_id in session.info.pop("class_access_changes", ()):
+        invalidate_class_access(user_id, class_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_class_access_changes(session: Session) -> None:
+    """Forget changes that were rolled back."""
+    session.info.pop("class_access_changes", None)
+
+
+def token_etag(token: str, *parts: str) -> str:
+    """Return the ETag for a response that depends only on the token and request path."""
+    digest = hashlib.sha256(":".join((token, *parts)).encode()).hexdigest()[:16]
+    return f'"{digest}"'
+
+
+def _get_cached_user(token_hash: str) -> Optional[Tuple[TokenData, User]]:
+    """Look up a verified token, skipping expired entries and revoked users."""
+    with _cache_lock:
+        entry = token_cache.get(token_hash)
+        if entry is None:
+            return None
+        token_data, user = entry
+        if user.id in revoked_users or token_data.exp <= datetime.utcnow():
+            token_cache.pop(token_hash, None)
+            return None
+        return entry
+
+
+def cache_verified_user(token: str, token_data: TokenData, user: User) -> None:
+    """Remember a freshly verified token and a detached snapshot of its user."""
+    with _cache_lock:
+        if user.id not in revoked_users:
+            token_cache[hash_token(token)] = (token_data, _detached_copy(user))
+
+
+def _detached_copy(user: User) -> User:
+    """Copy the user's column state into an instance safe to share across sessions."""
+    snapshot = User(**{
+        attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs
+    })
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def authenticate_token(token: str, db: Session) -> Optional[User]:
+    """Resolve a bearer token to its active user, honouring revocations and the cache."""
+    token_hash = hash_token(token)
+    with _cache_lock:
+        if token_hash in revoked_tokens:
+            return None
+    
+    cached = _get_cached_user(token_hash)
+    if cached is not None:
+        # Re-attach the snapshot to this session without a SELECT
+        return db.merge(cached[1], load=False)
+    
+    token_data: Optional[TokenData] = verify_token(token)
+    if token_data is None:
+        return None
+    
+    user = AuthService(db).get_user_by_id(token_data.user_id)
+    if user is None or not user.is_active:
+        return None
+    
+    cache_verified_user(token, token_data, user)
+    return user
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks = None
 ) -> User:
     """Get current authenticated user from JWT token."""
     credentials_exception = HTTPException(
@@ -28,21 +175,15 @@ async def get_current_user(
     )
     
     try:
-        token = credentials.credentials
-        token_data: Optional[TokenData] = verify_token(token)
-        
-        if token_data is None:
-            raise credentials_exception
-        
-        # Get user from database
-        auth_service = AuthService(db)
-        user = auth_service.get_user_by_id(token_data.user_id)
-        
-        if user is None or not user.is_active:
+        user = authenticate_token(credentials.credentials, db)
+        if user is None:
             raise credentials_exception
         
-        # Update user activity
-        auth_service.update_user_activity(user.id)
+        # Record activity after the response is sent, at most once per user per TTL
+        if background_tasks is None:
+            AuthService(db).update_user_activity(user.id)
+        elif claim_activity_update(user.id):
+            background_tasks.add_task(record_user_activity, user.id)
         
         return user
         
@@ -50,22 +191,19 @@ async def get_current_user(
         raise credentials_exception
 
 
+@lru_cache(maxsize=8)
 def require_role(required_role: str):
-    """Dependency factory for role-based access control."""
+    """Dependency factory for role-based access control.
+    
+    Memoized so every use of a role shares one dependency callable, which
+    FastAPI then resolves once per request.
+    """
+    required_mask = role_mask(required_role)
     
     async def role_checker(current_user: User = Depends(get_current_user)) -> User:
         """Check if current user has required role."""
         # Role hierarchy: admin > teacher > student
-        role_hierarchy = {
-            "admin": 3,
-            "teacher": 2,
-            "student": 1
-        }
-        
-        user_level = role_hierarchy.get(current_user.role, 0)
-        required_level = role_hierarchy.get(required_role, 0)
-        
-        if user_level < required_level:
+        if role_mask(current_user.role) & required_mask != required_mask:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Insufficient permissions. Required role: {required_role}"
@@ -97,50 +235,103 @@ class PermissionChecker:
     
     def __init__(self, db: Session):
         self.db = db
-        self.auth_service = AuthService(db)
+        # Document ownership resolved by preload_managed_documents, per user
+        self._preloaded_user_id: Optional[str] = None
+        self._preloaded: Set[str] = set()
+        self._manageable: Set[str] = set()
     
     def can_access_class(self, user: User, class_id: str) -> bool:
-        """Check if user can access a specific class."""
+        """Check if user can access a specific class, caching the decision briefly."""
         if user.role == "admin":
             return True
         
+        key = (user.id, class_id, user.role)
+        with _access_cache_lock:
+            allowed = _access_cache.get(key)
+        if allowed is None:
+            allowed = self._query_class_access(user, class_id)
+            with _access_cache_lock:
+                _access_cache[key] = allowed
+        return allowed
+    
+    def _query_class_access(self, user: User, class_id: str) -> bool:
+        """Look up class access for a teacher or student in the database."""
         if user.role == "teacher":
             # Teachers can access classes they teach
-            from ..models.models import Class
-            class_obj = self.db.query(Class).filter(
+            return self.db.query(exists().where(
                 Class.id == class_id,
                 Class.teacher_id == user.id
-            ).first()
-            return class_obj is not None
+            )).scalar()
         
         if user.role == "student":
             # Students can access classes they're enrolled in
-            from ..models.models import StudentAccess
-            access = self.db.query(StudentAccess).filter(
+            return self.db.query(exists().where(
                 StudentAccess.student_id == user.id,
                 StudentAccess.class_id == class_id,
                 StudentAccess.enabled == True
-            ).first()
-            return access is not None
+            )).scalar()
         
         return False
     
+    def check_class_access(self, user: User, class_id: str) -> Optional[Class]:
+        """Load a class if the user can access it, else return None."""
+        query = self.db.query(Class).filter(Class.id == class_id)
+        
+        if user.role == "admin":
+            return query.first()
+        
+        if user.role == "teacher":
+            # Teachers can access classes they teach
+            return query.filter(Class.teacher_id == user.id).first()
+        
+        if user.role == "student":
+            # Students can access classes they're enrolled in
+            return query.join(StudentAccess, StudentAccess.class_id == Class.id).filter(
+                StudentAccess.student_id == user.id,
+                StudentAccess.enabled == True
+            ).first()
+        
+        return None
+    
+    def preload_managed_documents(self, user: User, document_ids: Iterable[str]) -> None:
+        """Resolve which of the given documents the user can manage in one query."""
+        if user.role == "admin":
+            return
+        
+        document_ids = set(document_ids)
+        manageable: Set[str] = set()
+        if user.role == "teacher" and document_ids:
+            # A teacher manages a document assigned to any class they teach
+            rows = self.db.query(class_documents.c.document_id).join(
+                Class, Class.id == class_documents.c.class_id
+            ).filter(
+                class_documents.c.document_id.in_(document_ids),
+                Class.teacher_id == user.id
+            ).distinct().all()
+            manageable = {row[0] for row in rows}
+        
+        if self._preloaded_user_id != user.id:
+            self._preloaded_user_id = user.id
+            self._preloaded = set()
+            self._manageable = set()
+        self._preloaded |= document_ids
+        self._manageable |= manageable
+    
     def can_manage_document(self, user: User, document_id: str) -> bool:
         """Check if user can manage a specific document."""
         if user.role == "admin":
             return True
         
+        if self._preloaded_user_id == user.id and document_id in self._preloaded:
+            return document_id in self._manageable
+        
         if user.role == "teacher":
-            # Teachers can manage documents assigned to their classes
-            from ..models.models import Document, Class
-            document = self.db.query(Document).filter(Document.id == document_id).first()
-            if not document:
-                return False
-            
-            # Check if any of the document's assigned classes belong to this teacher
-            for class_obj in document.assigned_classes:
-                if class_obj.teacher_id == user.id:
-                    return True
+            # Teachers can manage documents assigned to any class they teach
+            return self.db.query(exists().where(
+                class_documents.c.document_id == document_id,
+                class_documents.c.class_id == Class.id,
+                Class.teacher_id == user.id
+            )).scalar()
         
         return False
     
@@ -161,4 +352,9 @@ class PermissionChecker:
 
 def get_permission_checker(db: Session = Depends(get_db)) -> PermissionChecker:
     """Get permission checker instance."""
-    return PermissionChecker(db)
\ No newline at end of file
+    return PermissionChecker(db)
+
+
+def get_auth_service(db: Session = Depends(get_db)) -> AuthService:
+    """Get auth service bound to the request's database session."""
+    return AuthService(db)
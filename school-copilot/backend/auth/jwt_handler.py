@@ -1,14 +1,70 @@
 """JWT token handling utilities."""
 
+import base64
+import binascii
+import calendar
+import hashlib
+import hmac
 import os
+import re
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from typing import Optional, Dict, Any, Tuple
+import bcrypt
+import orjson
+from argon2 import PasswordHasher, Type
+from argon2.exceptions import InvalidHashError, VerificationError
+import jwt
 
 from ..schemas.auth import TokenData
 from ..models.models import User
 
+# Registered claims that are encoded as NumericDate (seconds since the epoch)
+_NUMERIC_DATE_CLAIMS = ("exp", "iat", "nbf")
+
+# Claims every access token must carry
+_REQUIRED_CLAIMS = ("sub", "email", "role", "exp")
+
+# Cheap shape checks that reject junk before any base64 or HMAC work
+_TOKEN_LENGTH_BOUNDS = (32, 4096)
+_TOKEN_SHAPE = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+")
+
+# Hash prefixes written by bcrypt before the switch to argon2id
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+
+def _b64url(data: bytes) -> bytes:
+    """Base64url-encode without padding, as JWS requires."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64url_decode(data: str) -> bytes:
+    """Base64url-decode, restoring the padding JWS strips."""
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _verify_hs256(token: str, key: bytes) -> Dict[str, Any]:
+    """Check an HS256 signature and return the decoded payload.
+    
+    Raises jwt.InvalidTokenError for malformed tokens or bad signatures.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        signature = _b64url_decode(signature_b64)
+    except (ValueError, binascii.Error):
+        raise jwt.DecodeError("Malformed token")
+    
+    expected = hmac.new(key, f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+    
+    try:
+        payload = orjson.loads(_b64url_decode(payload_b64))
+    except (ValueError, binascii.Error):
+        raise jwt.DecodeError("Invalid payload")
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload")
+    return payload
+
 
 class JWTHandler:
     """JWT token handler for authentication."""
@@ -17,7 +73,19 @@ class JWTHandler:
         self.secret_key = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
         self.algorithm = "HS256"
         self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.access_token_expires = timedelta(minutes=self.access_token_expire_minutes)
+        # The JOSE header and signing key never change; prepare them once
+        self._header_b64 = _b64url(orjson.dumps({"alg": self.algorithm, "typ": "JWT"}))
+        self._header_prefix = self._header_b64.decode() + "."
+        self._hmac_key = self.secret_key.encode()
+        # argon2id for new hashes; existing bcrypt hashes still verify and are
+        # upgraded on the next successful login
+        self.password_hasher = PasswordHasher(
+            time_cost=2,
+            memory_cost=64 * 1024,
+            parallelism=1,
+            type=Type.ID,
+        )
     
     def create_access_token(self, data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
         """Create JWT access token."""
@@ -26,40 +94,92 @@ class JWTHandler:
         if expires_delta:
             expire = datetime.utcnow() + expires_delta
         else:
-            expire = datetime.utcnow() + timedelta(minutes=self.access_token_expire_minutes)
+            expire = datetime.utcnow() + self.access_token_expires
         
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
-        return encoded_jwt
+        for claim in _NUMERIC_DATE_CLAIMS:
+            value = to_encode.get(claim)
+            if isinstance(value, datetime):
+                to_encode[claim] = calendar.timegm(value.utctimetuple())
+        
+        # HS256 signature over the cached header and the serialized payload
+        signing_input = self._header_b64 + b"." + _b64url(orjson.dumps(to_encode))
+        signature = hmac.new(self._hmac_key, signing_input, hashlib.sha256).digest()
+        return (signing_input + b"." + _b64url(signature)).decode()
     
     def verify_token(self, token: str) -> Optional[TokenData]:
         """Verify and decode JWT token."""
+        min_length, max_length = _TOKEN_LENGTH_BOUNDS
+        if not min_length <= len(token) <= max_length or not _TOKEN_SHAPE.fullmatch(token):
+            return None
+        
+        # Verified results are cached by the auth dependencies, which also track revocation
+        return self._decode_token(token)
+    
+    def _decode_token(self, token: str) -> Optional[TokenData]:
+        """Decode and validate a JWT token's signature and claims."""
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
-            user_id: str = payload.get("sub")
-            email: str = payload.get("email")
-            role: str = payload.get("role")
-            exp: datetime = datetime.fromtimestamp(payload.get("exp"))
-            
-            if user_id is None or email is None or role is None:
-                return None
-            
+            if token.startswith(self._header_prefix):
+                # Our own header pins the algorithm, so verify HS256 directly
+                payload = _verify_hs256(token, self._hmac_key)
+                self._validate_claims(payload)
+            else:
+                # Missing or invalid claims are rejected by the decode itself
+                payload = jwt.decode(
+                    token,
+                    self.secret_key,
+                    algorithms=[self.algorithm],
+                    options={"require": list(_REQUIRED_CLAIMS)}
+                )
             return TokenData(
-                user_id=user_id,
-                email=email,
-                role=role,
-                exp=exp
+                user_id=payload["sub"],
+                email=payload["email"],
+                role=payload["role"],
+                exp=datetime.utcfromtimestamp(payload["exp"])
             )
-        except JWTError:
+        except jwt.PyJWTError:
             return None
     
+    def _validate_claims(self, payload: Dict[str, Any]) -> None:
+        """Apply the claim checks jwt.decode would for a directly verified token."""
+        for claim in _REQUIRED_CLAIMS:
+            if claim not in payload:
+                raise jwt.MissingRequiredClaimError(claim)
+        
+        now = calendar.timegm(datetime.utcnow().utctimetuple())
+        for claim in _NUMERIC_DATE_CLAIMS:
+            if claim in payload and not isinstance(payload[claim], (int, float)):
+                raise jwt.DecodeError(f"{claim} must be a number")
+        if payload["exp"] <= now:
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        if payload.get("nbf", now) > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid")
+    
     def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt."""
-        return self.pwd_context.hash(password)
+        """Hash password using argon2id."""
+        return self.password_hasher.hash(password)
     
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify password against hash."""
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return self.verify_and_update_password(plain_password, hashed_password)[0]
+    
+    def verify_and_update_password(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify password and return a replacement hash if the stored one is outdated."""
+        if hashed_password.startswith(_BCRYPT_PREFIXES):
+            try:
+                verified = bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+            except ValueError:
+                return False, None
+            return (True, self.hash_password(plain_password)) if verified else (False, None)
+        
+        try:
+            self.password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False, None
+        
+        if self.password_hasher.check_needs_rehash(hashed_password):
+            return True, self.hash_password(plain_password)
+        return True, None
     
     def create_user_token(self, user: User) -> str:
         """Create token for user."""
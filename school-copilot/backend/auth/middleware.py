@@ -1,7 +1,11 @@
 """Authentication and authorization middleware."""
 
+import itertools
+import os
 import time
-from typing import Optional, Callable
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Callable, Tuple
 from fastapi import Request, Response, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -10,8 +14,13 @@ from sqlalchemy.orm import Session
 from ..models.database import SessionLocal
 from ..models.models import User
 from ..schemas.auth import TokenData
-from .jwt_handler import verify_token
-from .auth_service import AuthService
+from .permissions import get_permission_service
+from .dependencies import authenticate_token
+
+
+# Request IDs: a random per-process prefix plus a counter, unique within the process
+_REQUEST_ID_PREFIX = os.urandom(3).hex()
+_request_counter = itertools.count()
 
 
 class AuthMiddleware(BaseHTTPMiddleware):
@@ -27,19 +36,21 @@ class AuthMiddleware(BaseHTTPMiddleware):
             "/health",
             "/"
         ]
+        # str.startswith accepts a tuple and checks every prefix in C
+        self._exclude_prefixes = tuple(self.exclude_paths)
     
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         """Process request through authentication middleware."""
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # Skip authentication for excluded paths
-        if any(request.url.path.startswith(path) for path in self.exclude_paths):
+        if request.url.path.startswith(self._exclude_prefixes):
             response = await call_next(request)
             self._add_security_headers(response)
             return response
         
         # Add request ID for tracking
-        request_id = f"req_{int(time.time() * 1000)}"
+        request_id = f"req_{_REQUEST_ID_PREFIX}{next(_request_counter):x}"
         request.state.request_id = request_id
         
         try:
@@ -50,7 +61,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             self._add_security_headers(response)
             
             # Add performance headers
-            process_time = time.time() - start_time
+            process_time = time.perf_counter() - start_time
             response.headers["X-Process-Time"] = str(process_time)
             response.headers["X-Request-ID"] = request_id
             
@@ -63,47 +74,37 @@ class AuthMiddleware(BaseHTTPMiddleware):
     
     def _add_security_headers(self, response: Response) -> None:
         """Add security headers to response."""
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline'; "
-            "style-src 'self' 'unsafe-inline'; "
-            "img-src 'self' data: https:; "
-            "font-src 'self'; "
-            "connect-src 'self'; "
-            "frame-ancestors 'none';"
-        )
+        response.raw_headers.extend(_SECURITY_HEADERS_RAW)
 
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Simple rate limiting middleware."""
+    """Simple rate limiting middleware using a sliding window counter per client."""
     
-    def __init__(self, app, requests_per_minute: int = 60):
+    def __init__(self, app, requests_per_minute: int = 60, max_clients: int = 10000):
         super().__init__(app)
         self.requests_per_minute = requests_per_minute
-        self.request_counts = {}  # In production, use Redis or similar
+        self.max_clients = max_clients
+        # client -> (window index, previous window count, current window count),
+        # least recently seen first; in production, use Redis or similar
+        self.request_counts: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
         self.window_size = 60  # 1 minute window
     
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         """Apply rate limiting."""
         client_ip = self._get_client_ip(request)
         current_time = time.time()
-        
-        # Clean old entries
-        self._cleanup_old_entries(current_time)
+        window = int(current_time // self.window_size)
+        previous, current = self._window_counts(client_ip, window)
         
         # Check rate limit
-        if self._is_rate_limited(client_ip, current_time):
+        if self._is_rate_limited(previous, current, current_time):
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Rate limit exceeded. Please try again later."
             )
         
         # Record request
-        self._record_request(client_ip, current_time)
+        self._record_request(client_ip, window, previous, current + 1)
         
         return await call_next(request)
     
@@ -120,32 +121,30 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         
         return request.client.host if request.client else "unknown"
     
-    def _cleanup_old_entries(self, current_time: float) -> None:
-        """Remove old entries outside the time window."""
-        cutoff_time = current_time - self.window_size
+    def _window_counts(self, client_ip: str, window: int) -> Tuple[int, int]:
+        """Get the client's request counts for the previous and current windows."""
+        entry = self.request_counts.get(client_ip)
+        if entry is None:
+            return 0, 0
         
-        for ip in list(self.request_counts.keys()):
-            self.request_counts[ip] = [
-                timestamp for timestamp in self.request_counts[ip]
-                if timestamp > cutoff_time
-            ]
-            
-            if not self.request_counts[ip]:
-                del self.request_counts[ip]
+        stored_window, previous, current = entry
+        if stored_window == window:
+            return previous, current
+        if stored_window == window - 1:
+            return current, 0
+        return 0, 0
     
-    def _is_rate_limited(self, client_ip: str, current_time: float) -> bool:
-        """Check if client is rate limited."""
-        if client_ip not in self.request_counts:
-            return False
-        
-        return len(self.request_counts[client_ip]) >= self.requests_per_minute
+    def _is_rate_limited(self, previous: int, current: int, current_time: float) -> bool:
+        """Check the weighted count of the last full window against the limit."""
+        elapsed = (current_time % self.window_size) / self.window_size
+        return previous * (1 - elapsed) + current >= self.requests_per_minute
     
-    def _record_request(self, client_ip: str, current_time: float) -> None:
-        """Record a request for rate limiting."""
-        if client_ip not in self.request_counts:
-            self.request_counts[client_ip] = []
-        
-        self.request_counts[client_ip].append(current_time)
+    def _record_request(self, client_ip: str, window: int, previous: int, current: int) -> None:
+        """Record a request, evicting the least recently seen client when full."""
+        self.request_counts[client_ip] = (window, previous, current)
+        self.request_counts.move_to_end(client_ip)
+        if len(self.request_counts) > self.max_clients:
+            self.request_counts.popitem(last=False)
 
 
 class PermissionMiddleware:
@@ -161,11 +160,9 @@ class PermissionMiddleware:
         required_access: str = "read"
     ) -> User:
         """Check if user has permission to access a class."""
-        user = await self._get_authenticated_user(request)
-        
-        db = SessionLocal()
-        try:
-            from .permissions import get_permission_service
+        # One session serves both the user lookup and the permission check
+        with SessionLocal() as db:
+            user = await self._get_authenticated_user(request, db)
             permission_service = get_permission_service(db)
             
             access_result = permission_service.check_class_access(user, class_id)
@@ -184,9 +181,6 @@ class PermissionMiddleware:
                 )
             
             return user
-            
-        finally:
-            db.close()
     
     async def check_document_permission(
         self,
@@ -195,11 +189,9 @@ class PermissionMiddleware:
         required_access: str = "read"
     ) -> User:
         """Check if user has permission to access a document."""
-        user = await self._get_authenticated_user(request)
-        
-        db = SessionLocal()
-        try:
-            from .permissions import get_permission_service
+        # One session serves both the user lookup and the permission check
+        with SessionLocal() as db:
+            user = await self._get_authenticated_user(request, db)
             permission_service = get_permission_service(db)
             
             access_result = permission_service.check_document_access(user, document_id)
@@ -218,11 +210,8 @@ class PermissionMiddleware:
                 )
             
             return user
-            
-        finally:
-            db.close()
     
-    async def _get_authenticated_user(self, request: Request) -> User:
+    async def _get_authenticated_user(self, request: Request, db: Session) -> User:
         """Get authenticated user from request."""
         # Extract token from Authorization header
         auth_header = request.headers.get("Authorization")
@@ -233,30 +222,16 @@ class PermissionMiddleware:
             )
         
         token = auth_header.split(" ")[1]
-        token_data = verify_token(token)
         
-        if not token_data:
+        # Same revocation checks and verification cache as get_current_user
+        user = authenticate_token(token, db)
+        if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired token"
             )
         
-        # Get user from database
-        db = SessionLocal()
-        try:
-            auth_service = AuthService(db)
-            user = auth_service.get_user_by_id(token_data.user_id)
-            
-            if not user or not user.is_active:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="User not found or inactive"
-                )
-            
-            return user
-            
-        finally:
-            db.close()
+        return user
 
 
 # Global middleware instances
@@ -264,8 +239,13 @@ permission_middleware = PermissionMiddleware()
 
 
 # Dependency functions for FastAPI
-async def require_class_access(class_id: str, access_type: str = "read"):
-    """Dependency factory for class access control."""
+@lru_cache(maxsize=128)
+def require_class_access(class_id: str, access_type: str = "read"):
+    """Dependency factory for class access control.
+    
+    Synchronous and memoized so it can be used directly in ``Depends(...)``
+    and every use of the same arguments shares one dependency callable.
+    """
     
     async def check_access(request: Request) -> User:
         return await permission_middleware.check_class_permission(request, class_id, access_type)
@@ -273,8 +253,9 @@ async def require_class_access(class_id: str, access_type: str = "read"):
     return check_access
 
 
-async def require_document_access(document_id: str, access_type: str = "read"):
-    """Dependency factory for document access control."""
+@lru_cache(maxsize=128)
+def require_document_access(document_id: str, access_type: str = "read"):
+    """Dependency factory for document access control (memoized like require_class_access)."""
     
     async def check_access(request: Request) -> User:
         return await permission_middleware.check_document_permission(request, document_id, access_type)
@@ -319,6 +300,7 @@ class SecurityConfig:
     )
     
     @classmethod
+    @lru_cache(maxsize=1)
     def get_cors_config(cls):
         """Get CORS configuration."""
         return {
@@ -326,4 +308,14 @@ class SecurityConfig:
             "allow_credentials": True,
             "allow_methods": cls.CORS_METHODS,
             "allow_headers": cls.CORS_HEADERS,
-        }
\ No newline at end of file
+        }
+
+
+# Security headers pre-encoded once, appended to every response in a single extend
+_SECURITY_HEADERS_RAW = tuple(
+    (name.lower().encode("latin-1"), value.encode("latin-1"))
+    for name, value in {
+        **SecurityConfig.SECURITY_HEADERS,
+        "Content-Security-Policy": SecurityConfig.CSP_POLICY,
+    }.items()
+)
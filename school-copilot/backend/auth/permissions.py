@@ -1,11 +1,61 @@
 """Permission checking service for fine-grained access control."""
 
-from typing import Optional, List, Dict, Any
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy import case, exists, func, update
 from sqlalchemy.orm import Session
 from datetime import datetime, date
 
-from ..models.models import User, Class, Document, StudentAccess, AuditLog
+from ..models.models import User, Class, Document, StudentAccess, AuditLog, class_documents
 from ..schemas.auth import TokenData
+from ..utils.validation import ValidationUtils
+
+
+class ClassMeta(NamedTuple):
+    """Class settings read by every class access check."""
+    version: int
+    enabled: bool
+    daily_question_limit: int
+    blocked_terms: Tuple[str, ...]
+    teacher_id: str
+
+
+# Class settings shared across requests; every use is validated against
+# Class.version, so the TTL only bounds how long idle entries are kept
+_class_meta_cache: TTLCache = TTLCache(maxsize=10000, ttl=600)
+_class_meta_lock = threading.Lock()
+
+
+def get_class_meta(db: Session, class_id: str) -> Optional[ClassMeta]:
+    """Return a class's access-related settings, or None if it does not exist."""
+    version = db.query(Class.version).filter(Class.id == class_id).scalar()
+    if version is None:
+        return None
+    
+    with _class_meta_lock:
+        meta = _class_meta_cache.get(class_id)
+    if meta is not None and meta.version == version:
+        return meta
+    
+    row = db.query(
+        Class.version, Class.enabled, Class.daily_question_limit, Class.blocked_terms, Class.teacher_id
+    ).filter(Class.id == class_id).first()
+    if row is None:
+        return None
+    
+    meta = ClassMeta(
+        row.version, row.enabled, row.daily_question_limit, tuple(row.blocked_terms or ()), row.teacher_id
+    )
+    with _class_meta_lock:
+        _class_meta_cache[class_id] = meta
+    return meta
+
+
+def invalidate_class_meta(class_id: str) -> None:
+    """Drop cached class settings (changes are also caught through Class.version)."""
+    with _class_meta_lock:
+        _class_meta_cache.pop(class_id, None)
 
 
 class PermissionService:
@@ -13,9 +63,24 @@ class PermissionService:
     
     def __init__(self, db: Session):
         self.db = db
+        # Results of check_* calls; the service lives for one request, so they cannot go stale
+        self._check_cache: Dict[Tuple, Dict[str, Any]] = {}
+    
+    def _memoized(self, key: Tuple, check: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Return a copy of a cached check result, running the check on first use."""
+        result = self._check_cache.get(key)
+        if result is None:
+            result = self._check_cache[key] = check()
+        # Copy the lists too, so callers cannot change the cached result
+        return {name: list(value) if isinstance(value, list) else value for name, value in result.items()}
     
     def check_class_access(self, user: User, class_id: str) -> Dict[str, Any]:
         """Check if user can access a specific class."""
+        return self._memoized(
+            ("class", user.id, class_id), lambda: self._check_class_access(user, class_id)
+        )
+    
+    def _check_class_access(self, user: User, class_id: str) -> Dict[str, Any]:
         result = {
             "has_access": False,
             "reason": None,
@@ -27,14 +92,14 @@ class PermissionService:
         }
         
         # Get class information
-        class_obj = self.db.query(Class).filter(Class.id == class_id).first()
+        class_obj = get_class_meta(self.db, class_id)
         if not class_obj:
             result["reason"] = "Class not found"
             return result
         
         result["class_enabled"] = class_obj.enabled
         result["daily_limit"] = class_obj.daily_question_limit
-        result["blocked_terms"] = class_obj.blocked_terms or []
+        result["blocked_terms"] = list(class_obj.blocked_terms)
         
         # Admin has access to everything
         if user.role == "admin":
@@ -58,8 +123,12 @@ class PermissionService:
                 result["reason"] = "Class is disabled"
                 return result
             
-            # Check student access record
-            student_access = self.db.query(StudentAccess).filter(
+            # Check student access record (only the columns read below, no ORM object)
+            student_access = self.db.query(
+                StudentAccess.enabled,
+                StudentAccess.daily_question_count,
+                StudentAccess.last_question_date
+            ).filter(
                 StudentAccess.student_id == user.id,
                 StudentAccess.class_id == class_id
             ).first()
@@ -76,7 +145,11 @@ class PermissionService:
             
             # Check daily question limit
             today = date.today()
-            if student_access.last_question_date == today:
+            # The column is DATE in the SQL schemas but DateTime on the model
+            last_asked = student_access.last_question_date
+            if isinstance(last_asked, datetime):
+                last_asked = last_asked.date()
+            if last_asked == today:
                 questions_used = student_access.daily_question_count
             else:
                 questions_used = 0
@@ -94,8 +167,20 @@ class PermissionService:
         result["reason"] = "Invalid user role"
         return result
     
-    def check_document_access(self, user: User, document_id: str) -> Dict[str, Any]:
-        """Check if user can access a specific document."""
+    def check_document_access(
+        self, user: User, document_id: str, include_classes: bool = False
+    ) -> Dict[str, Any]:
+        """Check if user can access a specific document.
+        
+        ``assigned_classes`` is only filled in when ``include_classes`` is set
+        and access is granted.
+        """
+        return self._memoized(
+            ("document", user.id, document_id, include_classes),
+            lambda: self._check_document_access(user, document_id, include_classes)
+        )
+    
+    def _check_document_access(self, user: User, document_id: str, include_classes: bool) -> Dict[str, Any]:
         result = {
             "has_access": False,
             "reason": None,
@@ -103,59 +188,69 @@ class PermissionService:
             "assigned_classes": []
         }
         
-        # Get document
-        document = self.db.query(Document).filter(Document.id == document_id).first()
-        if not document:
+        if not self.db.query(exists().where(Document.id == document_id)).scalar():
             result["reason"] = "Document not found"
             return result
         
-        result["assigned_classes"] = [cls.id for cls in document.assigned_classes]
-        
         # Admin has full access
         if user.role == "admin":
             result["has_access"] = True
             result["can_manage"] = True
-            return result
         
         # Teacher access - can access documents assigned to their classes
-        if user.role == "teacher":
-            teacher_classes = self.db.query(Class).filter(Class.teacher_id == user.id).all()
-            teacher_class_ids = {cls.id for cls in teacher_classes}
-            
-            document_class_ids = {cls.id for cls in document.assigned_classes}
+        elif user.role == "teacher":
+            # Answered by the database instead of intersecting every class they teach
+            teaches_assigned_class = self.db.query(exists().where(
+                class_documents.c.document_id == document_id,
+                class_documents.c.class_id == Class.id,
+                Class.teacher_id == user.id
+            )).scalar()
             
-            if teacher_class_ids.intersection(document_class_ids):
+            if teaches_assigned_class:
                 result["has_access"] = True
                 result["can_manage"] = True
-                return result
             else:
                 result["reason"] = "Document not assigned to your classes"
-                return result
         
         # Student access - can access documents assigned to classes they're enrolled in
-        if user.role == "student":
-            # Get student's accessible classes
-            student_classes = self.db.query(StudentAccess).filter(
+        elif user.role == "student":
+            enrolled_in_assigned_class = self.db.query(exists().where(
+                class_documents.c.document_id == document_id,
+                class_documents.c.class_id == StudentAccess.class_id,
                 StudentAccess.student_id == user.id,
                 StudentAccess.enabled == True
-            ).all()
-            
-            student_class_ids = {access.class_id for access in student_classes}
-            document_class_ids = {cls.id for cls in document.assigned_classes}
+            )).scalar()
             
-            if student_class_ids.intersection(document_class_ids):
+            if enrolled_in_assigned_class:
                 result["has_access"] = True
-                result["can_manage"] = False
-                return result
             else:
                 result["reason"] = "Document not available in your classes"
-                return result
         
-        result["reason"] = "Invalid user role"
+        else:
+            result["reason"] = "Invalid user role"
+        
+        if include_classes and result["has_access"]:
+            result["assigned_classes"] = [
+                class_id for (class_id,) in self.db.query(class_documents.c.class_id).filter(
+                    class_documents.c.document_id == document_id
+                )
+            ]
         return result
     
     def check_audit_log_access(self, user: User, class_id: Optional[str] = None, student_id: Optional[str] = None) -> Dict[str, Any]:
-        """Check if user can access audit logs."""
+        """Check if user can access audit logs.
+        
+        For teachers, ``accessible_classes`` lists every class they teach, or
+        only ``class_id`` when a specific accessible class is requested.
+        """
+        return self._memoized(
+            ("audit_log", user.id, class_id, student_id),
+            lambda: self._check_audit_log_access(user, class_id, student_id)
+        )
+    
+    def _check_audit_log_access(
+        self, user: User, class_id: Optional[str], student_id: Optional[str]
+    ) -> Dict[str, Any]:
         result = {
             "has_access": False,
             "reason": None,
@@ -171,18 +266,22 @@ class PermissionService:
         
         # Teacher access - can view logs for their classes
         if user.role == "teacher":
-            teacher_classes = self.db.query(Class).filter(Class.teacher_id == user.id).all()
-            accessible_class_ids = [cls.id for cls in teacher_classes]
-            result["accessible_classes"] = accessible_class_ids
-            
             if class_id:
-                if class_id in accessible_class_ids:
+                teaches_class = self.db.query(exists().where(
+                    Class.id == class_id,
+                    Class.teacher_id == user.id
+                )).scalar()
+                if teaches_class:
+                    result["accessible_classes"] = [class_id]
                     result["has_access"] = True
                     return result
                 else:
                     result["reason"] = "Cannot access logs for this class"
                     return result
             else:
+                result["accessible_classes"] = [
+                    cls_id for (cls_id,) in self.db.query(Class.id).filter(Class.teacher_id == user.id)
+                ]
                 result["has_access"] = True
                 return result
         
@@ -200,27 +299,27 @@ class PermissionService:
             return False
         
         try:
-            student_access = self.db.query(StudentAccess).filter(
-                StudentAccess.student_id == user_id,
-                StudentAccess.class_id == class_id
-            ).first()
-            
-            if not student_access:
-                return False
-            
-            today = date.today()
-            
-            # Reset count if it's a new day
-            if student_access.last_question_date != today:
-                student_access.daily_question_count = 0
-                student_access.last_question_date = today
-            
-            # Increment count
-            student_access.daily_question_count += 1
-            student_access.updated_at = datetime.utcnow()
+            # Increment in one UPDATE, restarting the count on a new day
+            now = datetime.utcnow()
+            asked_today = func.date(StudentAccess.last_question_date) == date.today()
+            result = self.db.execute(
+                update(StudentAccess)
+                .where(
+                    StudentAccess.student_id == user_id,
+                    StudentAccess.class_id == class_id
+                )
+                .values(
+                    daily_question_count=case((asked_today, StudentAccess.daily_question_count + 1), else_=1),
+                    last_question_date=now,
+                    updated_at=now
+                )
+                .execution_options(synchronize_session=False)
+            )
             
             self.db.commit()
-            return True
+            # The memoized class check still holds the old remaining_questions
+            self._check_cache.pop(("class", user_id, class_id), None)
+            return result.rowcount == 1
             
         except Exception:
             self.db.rollback()
@@ -255,27 +354,27 @@ class PermissionService:
                 })
         
         elif user.role == "student":
-            # Students see classes they're enrolled in
-            student_access_records = self.db.query(StudentAccess).filter(
+            # Students see classes they're enrolled in, loaded with their access rows
+            student_access_records = self.db.query(StudentAccess, Class).join(
+                Class, Class.id == StudentAccess.class_id
+            ).filter(
                 StudentAccess.student_id == user.id
             ).all()
             
-            for access in student_access_records:
-                cls = self.db.query(Class).filter(Class.id == access.class_id).first()
-                if cls:
-                    today = date.today()
-                    questions_used = access.daily_question_count if access.last_question_date == today else 0
-                    remaining = max(0, cls.daily_question_limit - questions_used)
-                    
-                    classes.append({
-                        "id": cls.id,
-                        "name": cls.name,
-                        "role": "student",
-                        "enabled": cls.enabled and access.enabled,
-                        "daily_limit": cls.daily_question_limit,
-                        "questions_used": questions_used,
-                        "remaining_questions": remaining
-                    })
+            today = date.today()
+            for access, cls in student_access_records:
+                questions_used = access.daily_question_count if access.last_question_date == today else 0
+                remaining = max(0, cls.daily_question_limit - questions_used)
+                
+                classes.append({
+                    "id": cls.id,
+                    "name": cls.name,
+                    "role": "student",
+                    "enabled": cls.enabled and access.enabled,
+                    "daily_limit": cls.daily_question_limit,
+                    "questions_used": questions_used,
+                    "remaining_questions": remaining
+                })
         
         return classes
     
@@ -291,16 +390,15 @@ class PermissionService:
                 "blocked_term": None
             }
         
-        # Check blocked terms for students
+        # Check blocked terms for students with the class's compiled matcher
         if user.role == "student" and access_result["blocked_terms"]:
-            query_lower = query.lower()
-            for term in access_result["blocked_terms"]:
-                if term.lower() in query_lower:
-                    return {
-                        "allowed": False,
-                        "reason": "Query contains blocked content",
-                        "blocked_term": term
-                    }
+            term = ValidationUtils.validate_blocked_terms(query, access_result["blocked_terms"])
+            if term:
+                return {
+                    "allowed": False,
+                    "reason": "Query contains blocked content",
+                    "blocked_term": term
+                }
         
         return {
             "allowed": True,
@@ -5,6 +5,7 @@ import asyncio
 import sys
 import os
 from pathlib import Path
+from sqlalchemy import insert
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
@@ -15,6 +16,11 @@ from services.class_isolation_service import ClassIsolationService
 from auth.auth_service import AuthService
 
 
+def users_by_email(db, emails):
+    """Load the users for a set of emails in one query."""
+    return {user.email: user for user in db.query(User).filter(User.email.in_(set(emails)))}
+
+
 async def create_test_scenario():
     """Create comprehensive test scenario for isolation testing."""
     db = SessionLocal()
@@ -88,67 +94,61 @@ async def create_test_scenario():
         
         db.add_all([math_doc, science_doc, shared_doc])
         
-        # Create document chunks
-        math_chunks = [
-            DocumentChunk(
-                id="math_chunk_1",
-                document_id="math_textbook",
-                content="Algebra is the branch of mathematics that uses symbols to represent numbers and quantities in formulas and equations.",
-                token_count=20,
-                chunk_index=0,
-                page_number=1
-            ),
-            DocumentChunk(
-                id="math_chunk_2", 
-                document_id="math_textbook",
-                content="Linear equations are equations that make a straight line when graphed. The general form is y = mx + b.",
-                token_count=18,
-                chunk_index=1,
-                page_number=15
-            )
+        # Parent rows must exist before the bulk inserts below reference them
+        db.flush()
+        
+        # Create document chunks in one executemany
+        chunk_rows = [
+            {
+                "id": "math_chunk_1",
+                "document_id": "math_textbook",
+                "content": "Algebra is the branch of mathematics that uses symbols to represent numbers and quantities in formulas and equations.",
+                "token_count": 20,
+                "chunk_index": 0,
+                "page_number": 1
+            },
+            {
+                "id": "math_chunk_2",
+                "document_id": "math_textbook",
+                "content": "Linear equations are equations that make a straight line when graphed. The general form is y = mx + b.",
+                "token_count": 18,
+                "chunk_index": 1,
+                "page_number": 15
+            },
+            {
+                "id": "science_chunk_1",
+                "document_id": "science_textbook",
+                "content": "Chemistry is the study of matter and the changes it undergoes. Atoms are the basic building blocks of matter.",
+                "token_count": 19,
+                "chunk_index": 0,
+                "page_number": 1
+            },
+            {
+                "id": "science_chunk_2",
+                "document_id": "science_textbook",
+                "content": "Chemical reactions involve the breaking and forming of bonds between atoms to create new substances.",
+                "token_count": 16,
+                "chunk_index": 1,
+                "page_number": 25
+            },
+            {
+                "id": "shared_chunk_1",
+                "document_id": "shared_resource",
+                "content": "Effective study techniques include active reading, note-taking, and regular review of material.",
+                "token_count": 14,
+                "chunk_index": 0,
+                "page_number": 5
+            }
         ]
-        
-        science_chunks = [
-            DocumentChunk(
-                id="science_chunk_1",
-                document_id="science_textbook", 
-                content="Chemistry is the study of matter and the changes it undergoes. Atoms are the basic building blocks of matter.",
-                token_count=19,
-                chunk_index=0,
-                page_number=1
-            ),
-            DocumentChunk(
-                id="science_chunk_2",
-                document_id="science_textbook",
-                content="Chemical reactions involve the breaking and forming of bonds between atoms to create new substances.",
-                token_count=16,
-                chunk_index=1,
-                page_number=25
-            )
-        ]
-        
-        shared_chunks = [
-            DocumentChunk(
-                id="shared_chunk_1",
-                document_id="shared_resource",
-                content="Effective study techniques include active reading, note-taking, and regular review of material.",
-                token_count=14,
-                chunk_index=0,
-                page_number=5
-            )
-        ]
-        
-        db.add_all(math_chunks + science_chunks + shared_chunks)
+        db.execute(insert(DocumentChunk), chunk_rows)
         
         # Create student access records
-        student_access = [
-            StudentAccess(student_id=student1.id, class_id="math_101", enabled=True),
-            StudentAccess(student_id=student2.id, class_id="science_101", enabled=True),
-            StudentAccess(student_id=student3.id, class_id="math_101", enabled=True),
-            StudentAccess(student_id=student3.id, class_id="science_101", enabled=False)  # Disabled access
-        ]
-        
-        db.add_all(student_access)
+        db.execute(insert(StudentAccess), [
+            {"student_id": student1.id, "class_id": "math_101", "enabled": True},
+            {"student_id": student2.id, "class_id": "science_101", "enabled": True},
+            {"student_id": student3.id, "class_id": "math_101", "enabled": True},
+            {"student_id": student3.id, "class_id": "science_101", "enabled": False}  # Disabled access
+        ])
         db.commit()
         
         print("✅ Test scenario created successfully")
@@ -219,9 +219,9 @@ async def test_class_isolation():
             ("student3@example.edu", "science_101", False),  # Disabled access
         ]
         
+        students = users_by_email(db, (case[0] for case in test_cases))
         for student_email, class_id, expected in test_cases:
-            # Get student ID from email
-            student = db.query(User).filter(User.email == student_email).first()
+            student = students.get(student_email)
             if student:
                 has_access = isolation_service.verify_student_access(student.id, class_id)
                 status = "✅" if has_access == expected else "❌"
@@ -237,8 +237,9 @@ async def test_class_isolation():
             ("student2@example.edu", "math_101", "What are linear equations?", False),
         ]
         
+        students = users_by_email(db, (test[0] for test in query_tests))
         for student_email, class_id, query, should_allow in query_tests:
-            student = db.query(User).filter(User.email == student_email).first()
+            student = students.get(student_email)
             if student:
                 result = isolation_service.verify_query_isolation(student.id, class_id, query)
                 allowed = result["allowed"]
@@ -271,8 +272,9 @@ async def test_class_isolation():
             ("student2@example.edu", "math_101"),     # Science student trying Math class
         ]
         
+        students = users_by_email(db, (test[0] for test in contamination_tests))
         for student_email, wrong_class_id in contamination_tests:
-            student = db.query(User).filter(User.email == student_email).first()
+            student = students.get(student_email)
             if student:
                 result = isolation_service.verify_query_isolation(student.id, wrong_class_id, "test query")
                 blocked = not result["allowed"]
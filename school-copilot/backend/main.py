@@ -6,14 +6,17 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import time
+import anyio.to_thread
 
 from .models.database import create_tables
+from .models.schema_manager import upgrade_database_schema
 from .api import auth, classes, documents, queries, logs
 from .auth.auth_service import AuthService
+from .services.audit_log_writer import audit_log_writer
 from .models.database import get_db
 
 
@@ -31,10 +34,19 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting School Co-Pilot backend...")
     
+    # Sync endpoints run in anyio's threadpool; match it to the DB pool size
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(
+        os.getenv("THREADPOOL_SIZE", "100")
+    )
+    
     # Create database tables
     create_tables()
+    upgrade_database_schema()
     logger.info("Database tables created/verified")
     
+    # Ensure the upload directory exists once rather than on every upload
+    os.makedirs(documents.DOCUMENTS_DIR, exist_ok=True)
+    
     # Create demo users for development
     if os.getenv("CREATE_DEMO_USERS", "false").lower() == "true":
         db = next(get_db())
@@ -45,10 +57,14 @@ async def lifespan(app: FastAPI):
         finally:
             db.close()
     
+    # Batch failed-query audit logs in the background
+    audit_log_writer.start()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down School Co-Pilot backend...")
+    await audit_log_writer.stop()
 
 
 # Create FastAPI app
@@ -58,6 +74,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -80,7 +97,6 @@ app.add_middleware(
     allowed_hosts=["localhost", "127.0.0.1", "*.edu"]
 )
 
-
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
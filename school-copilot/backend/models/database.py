@@ -18,8 +18,18 @@ if DATABASE_URL.startswith("sqlite"):
         echo=False
     )
 else:
-    # PostgreSQL or other databases
-    engine = create_engine(DATABASE_URL, echo=False)
+    # PostgreSQL or other databases; size the pool for concurrent requests
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        # Reuse the most recently returned connection so idle ones can time out
+        pool_use_lifo=True,
+        echo=False
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -27,11 +37,8 @@ Base = declarative_base()
 
 def get_db():
     """Dependency to get database session."""
-    db = SessionLocal()
-    try:
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 def create_tables():
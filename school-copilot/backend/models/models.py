@@ -1,5 +1,6 @@
 """SQLAlchemy models for School Co-Pilot."""
 
+import uuid
 from datetime import datetime
 from typing import List, Optional
 from sqlalchemy import (
@@ -8,13 +9,17 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
     JSON,
     Table,
+    UniqueConstraint,
+    event,
+    text,
 )
-from sqlalchemy.orm import relationship, Mapped, mapped_column
+from sqlalchemy.orm import relationship, Mapped, mapped_column, object_session
 from .database import Base
 
 
@@ -24,6 +29,8 @@ class_documents = Table(
     Base.metadata,
     Column("class_id", String, ForeignKey("classes.id"), primary_key=True),
     Column("document_id", String, ForeignKey("documents.id"), primary_key=True),
+    # The primary key covers lookups by class; this covers lookups by document
+    Index("idx_class_documents_document", "document_id", "class_id"),
 )
 
 
@@ -31,6 +38,7 @@ class User(Base):
     """User model for teachers, students, and admins."""
     
     __tablename__ = "users"
+    __table_args__ = (Index("idx_users_role_active", "role", "is_active"),)
     
     id: Mapped[str] = mapped_column(String, primary_key=True)
     email: Mapped[str] = mapped_column(String, unique=True, index=True)
@@ -57,13 +65,16 @@ class Class(Base):
     """Class model for organizing students and documents."""
     
     __tablename__ = "classes"
+    __table_args__ = (Index("idx_classes_teacher", "teacher_id"),)
     
-    id: Mapped[str] = mapped_column(String, primary_key=True)
+    id: Mapped[str] = mapped_column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name: Mapped[str] = mapped_column(String)
     teacher_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"))
     enabled: Mapped[bool] = mapped_column(Boolean, default=True)
     daily_question_limit: Mapped[int] = mapped_column(Integer, default=50)
     blocked_terms: Mapped[List[str]] = mapped_column(JSON, default=list)
+    # Bumped on every change so cached class settings can be validated cheaply
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default=text("1"))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -79,6 +90,14 @@ class Class(Base):
     )
 
 
+@event.listens_for(Class, "before_update")
+def _bump_class_version(mapper, connection, target: Class) -> None:
+    """Increment the version whenever a class's own columns change."""
+    session = object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        target.version = (target.version or 0) + 1
+
+
 class Document(Base):
     """Document model for storing uploaded files and metadata."""
     
@@ -95,6 +114,7 @@ class Document(Base):
     upload_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     last_indexed: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     doc_metadata: Mapped[dict] = mapped_column(JSON, default=dict)
+    chunk_count: Mapped[int] = mapped_column(Integer, default=0)  # Kept in sync by RAGService
     
     # Relationships
     assigned_classes: Mapped[List["Class"]] = relationship(
@@ -127,6 +147,17 @@ class StudentAccess(Base):
     """Student access control model."""
     
     __tablename__ = "student_access"
+    __table_args__ = (
+        UniqueConstraint("student_id", "class_id"),
+        Index("idx_student_access_class_enabled", "class_id", "enabled"),
+        # Partial index matching the enrolled-classes lookup for students
+        Index(
+            "idx_student_access_student_enabled",
+            "student_id",
+            postgresql_where=text("enabled = TRUE"),
+            sqlite_where=text("enabled = TRUE"),
+        ),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     student_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"))
@@ -146,6 +177,12 @@ class AuditLog(Base):
     """Audit log model for tracking student activities."""
     
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        # Log listings filter by class or student and page newest first
+        Index("idx_audit_logs_class_timestamp", "class_id", "timestamp"),
+        Index("idx_audit_logs_student_timestamp", "student_id", "timestamp"),
+        Index("idx_audit_logs_class_success_timestamp", "class_id", "success", "timestamp"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     student_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"))
@@ -4,12 +4,43 @@ import os
 import logging
 from pathlib import Path
 from typing import Optional
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.engine import Engine
-from .database import engine, DATABASE_URL
+from .database import Base, engine, DATABASE_URL
 
 logger = logging.getLogger(__name__)
 
+# Columns added after the first release: (table, column, DDL type and default,
+# optional statement that fills the new column from existing rows).
+# create_all never alters existing tables, so upgrade_schema adds these in place
+ADDED_COLUMNS = (
+    ("classes", "version", "INTEGER NOT NULL DEFAULT 1", None),
+    (
+        "documents", "chunk_count", "INTEGER DEFAULT 0",
+        "UPDATE documents SET chunk_count = ("
+        "SELECT COUNT(*) FROM document_chunks WHERE document_chunks.document_id = documents.id)",
+    ),
+)
+
+# Unique keys that upserts rely on: (table, columns, index name). Older tables
+# may hold duplicates, so all but the newest row of each key are dropped first
+ADDED_UNIQUE_KEYS = (
+    ("student_access", ("student_id", "class_id"), "uq_student_access_student_class"),
+)
+
+# Indexes declared on the models after the first release; their definitions
+# are taken from Base.metadata and created only where missing
+ADDED_INDEXES = (
+    "idx_users_role_active",
+    "idx_classes_teacher",
+    "idx_class_documents_document",
+    "idx_student_access_class_enabled",
+    "idx_student_access_student_enabled",
+    "idx_audit_logs_class_timestamp",
+    "idx_audit_logs_student_timestamp",
+    "idx_audit_logs_class_success_timestamp",
+)
+
 
 class SchemaManager:
     """Manages database schema creation and migrations."""
@@ -105,6 +136,64 @@ class SchemaManager:
             logger.error(f"Failed to verify schema: {e}")
             return False
     
+    def upgrade_schema(self) -> bool:
+        """Add columns, keys and indexes introduced since an existing database was created."""
+        try:
+            with self.engine.connect() as conn:
+                # Inspect through the same connection so lookups never end the
+                # transaction holding the changes below
+                inspector = inspect(conn)
+                existing_tables = set(inspector.get_table_names())
+                
+                for table, column, ddl, backfill in ADDED_COLUMNS:
+                    if table not in existing_tables:
+                        continue
+                    if column in {col["name"] for col in inspector.get_columns(table)}:
+                        continue
+                    
+                    logger.info(f"Adding column {table}.{column}")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                    if backfill:
+                        conn.execute(text(backfill))
+                
+                for table, columns, name in ADDED_UNIQUE_KEYS:
+                    if table not in existing_tables or self._has_unique_key(inspector, table, columns):
+                        continue
+                    
+                    key = ", ".join(columns)
+                    logger.info(f"Adding unique key {table}({key})")
+                    conn.execute(text(
+                        f"DELETE FROM {table} WHERE id NOT IN "
+                        f"(SELECT MAX(id) FROM {table} GROUP BY {key})"
+                    ))
+                    conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({key})"))
+                
+                # Column lists may have changed above
+                inspector.clear_cache()
+                for table in Base.metadata.sorted_tables:
+                    if table.name not in existing_tables:
+                        continue
+                    columns = {col["name"] for col in inspector.get_columns(table.name)}
+                    for index in table.indexes:
+                        if index.name in ADDED_INDEXES and {col.name for col in index.columns} <= columns:
+                            index.create(conn, checkfirst=True)
+                
+                conn.commit()
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to upgrade schema: {e}")
+            return False
+    
+    @staticmethod
+    def _has_unique_key(inspector, table: str, columns: tuple) -> bool:
+        """Check whether a unique constraint or unique index covers exactly these columns."""
+        wanted = set(columns)
+        constraints = inspector.get_unique_constraints(table)
+        indexes = [index for index in inspector.get_indexes(table) if index.get("unique")]
+        return any(set(key["column_names"]) == wanted for key in (*constraints, *indexes))
+    
     def get_table_info(self, table_name: str) -> Optional[dict]:
         """Get information about a specific table."""
         try:
@@ -198,6 +287,12 @@ def verify_database_schema() -> bool:
     return manager.verify_schema()
 
 
+def upgrade_database_schema() -> bool:
+    """Upgrade database schema using the default engine."""
+    manager = SchemaManager()
+    return manager.upgrade_schema()
+
+
 def get_schema_info() -> dict:
     """Get comprehensive schema information."""
     manager = SchemaManager()
@@ -2,7 +2,7 @@
 
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import AliasChoices, BaseModel, Field
 
 
 class DocumentChunkResponse(BaseModel):
@@ -45,8 +45,13 @@ class DocumentResponse(BaseModel):
     status: str
     upload_date: datetime
     last_indexed: Optional[datetime] = None
-    metadata: Dict[str, Any]
-    assigned_classes: List[str] = Field(default_factory=list)
+    # Read from Document.doc_metadata and the class IDs set by the documents API
+    # when validated from an ORM object
+    metadata: Dict[str, Any] = Field(validation_alias=AliasChoices("doc_metadata", "metadata"))
+    assigned_classes: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("assigned_class_ids", "assigned_classes")
+    )
     chunk_count: int = 0
     
     class Config:
@@ -24,6 +24,7 @@ CREATE TABLE IF NOT EXISTS classes (
     enabled BOOLEAN DEFAULT TRUE,
     daily_question_limit INTEGER DEFAULT 50 CHECK (daily_question_limit > 0),
     blocked_terms JSONB DEFAULT '[]'::jsonb,
+    version INTEGER NOT NULL DEFAULT 1, -- bumped on every update
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (teacher_id) REFERENCES users(id) ON DELETE CASCADE
 );
@@ -40,7 +41,8 @@ CREATE TABLE IF NOT EXISTS documents (
     status VARCHAR(20) DEFAULT 'processing' CHECK (status IN ('processing', 'ready', 'error')),
     upload_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     last_indexed TIMESTAMP WITH TIME ZONE,
-    doc_metadata JSONB DEFAULT '{}'::jsonb
+    doc_metadata JSONB DEFAULT '{}'::jsonb,
+    chunk_count INTEGER DEFAULT 0 CHECK (chunk_count >= 0)
 );
 
 -- Document chunks table for RAG pipeline
@@ -100,8 +102,10 @@ CREATE TABLE IF NOT EXISTS audit_logs (
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+CREATE INDEX IF NOT EXISTS idx_users_role_active ON users(role, is_active);
 CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active);
 CREATE INDEX IF NOT EXISTS idx_classes_teacher ON classes(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_class_documents_document ON class_documents(document_id, class_id);
 CREATE INDEX IF NOT EXISTS idx_classes_enabled ON classes(enabled);
 CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status);
 CREATE INDEX IF NOT EXISTS idx_documents_type ON documents(file_type);
@@ -110,10 +114,15 @@ CREATE INDEX IF NOT EXISTS idx_chunks_document ON document_chunks(document_id);
 CREATE INDEX IF NOT EXISTS idx_chunks_document_index ON document_chunks(document_id, chunk_index);
 CREATE INDEX IF NOT EXISTS idx_student_access_student ON student_access(student_id);
 CREATE INDEX IF NOT EXISTS idx_student_access_class ON student_access(class_id);
+CREATE INDEX IF NOT EXISTS idx_student_access_class_enabled ON student_access(class_id, enabled);
+CREATE INDEX IF NOT EXISTS idx_student_access_student_enabled ON student_access(student_id) WHERE enabled = TRUE;
 CREATE INDEX IF NOT EXISTS idx_student_access_enabled ON student_access(enabled);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_student ON audit_logs(student_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_class ON audit_logs(class_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_class_timestamp ON audit_logs(class_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_student_timestamp ON audit_logs(student_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_class_success_timestamp ON audit_logs(class_id, success, timestamp);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_success ON audit_logs(success);
 
 -- GIN indexes for JSONB columns (PostgreSQL specific)
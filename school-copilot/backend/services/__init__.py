@@ -1,11 +1,12 @@
 """Service modules for School Co-Pilot backend."""
 
 from .document_processor import DocumentProcessor
-from .rag_service import RAGService
+from .rag_service import RAGService, get_rag_service
 from .embedding_service import EmbeddingService
 
 __all__ = [
     "DocumentProcessor",
     "RAGService", 
+    "get_rag_service",
     "EmbeddingService",
 ]
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Batched background writer for audit log rows."""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from ..models.database import SessionLocal
+from ..models.models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter:
+    """Queue audit log rows and insert them in batches off the request path."""
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the background task is accepting rows."""
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the background flush task on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush queued rows and stop the background task."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    def enqueue(self, row: Dict[str, Any]) -> bool:
+        """Queue a row for insertion; returns False if the writer is not running."""
+        if not self.running:
+            return False
+        self._queue.put_nowait(row)
+        return True
+
+    async def _run(self) -> None:
+        """Collect rows until the batch fills or the flush interval passes."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            await run_in_threadpool(self._write, batch)
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        """Insert a batch of rows with a single executemany."""
+        db = SessionLocal()
+        try:
+            db.execute(insert(AuditLog), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to write %d audit log rows", len(rows))
+        finally:
+            db.close()
+
+
+# Global writer started and stopped by the application lifespan
+audit_log_writer = AuditLogWriter()
@@ -1,12 +1,13 @@
 """Class-based document isolation service for strict data separation."""
 
 import logging
+from collections import defaultdict
 from typing import List, Dict, Set, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, exists, func, insert, literal, or_, select
 
-from ..models.models import Class, Document, DocumentChunk, StudentAccess, User
-from .embedding_service import VectorDatabase
+from ..models.models import Class, Document, DocumentChunk, StudentAccess, User, class_documents
+from .embedding_service import get_vector_database
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +18,16 @@ class ClassIsolationService:
     
     def __init__(self, db: Session):
         self.db = db
-        self.vector_db = VectorDatabase()
+        # Same in-memory indexes the RAG service searches
+        self.vector_db = get_vector_database()
+    
+    def _get_document_chunk_counts(self) -> List[Tuple[Document, int]]:
+        """Get every document with its chunk count in one grouped query."""
+        return self.db.query(
+            Document, func.count(DocumentChunk.id)
+        ).outerjoin(
+            DocumentChunk, DocumentChunk.document_id == Document.id
+        ).group_by(Document.id).all()
     
     def create_class_collection(self, class_id: str) -> bool:
         """Create isolated document collection for a class."""
@@ -220,60 +230,94 @@ class ClassIsolationService:
                 return {"error": "Class not found"}
             
             # Get class documents
-            class_documents = list(class_obj.documents)
+            assigned_ids = {doc.id for doc in class_obj.documents}
             
             # Get students with access
-            student_access = self.db.query(StudentAccess).filter(
-                StudentAccess.class_id == class_id
-            ).all()
-            
-            enabled_students = [access for access in student_access if access.enabled]
-            
-            # Get vector index stats
-            index_stats = self.vector_db.get_index_stats(class_id)
-            
-            # Check for potential cross-class document access
-            all_documents = self.db.query(Document).all()
-            cross_class_docs = []
+            enrollments = [
+                enabled for (enabled,) in self.db.query(StudentAccess.enabled).filter(
+                    StudentAccess.class_id == class_id
+                ).all()
+            ]
             
-            for doc in all_documents:
-                if doc not in class_documents:
-                    # Check if any chunks from this doc might be in the class index
-                    doc_chunks = self.db.query(DocumentChunk).filter(
-                        DocumentChunk.document_id == doc.id
-                    ).count()
-                    
-                    if doc_chunks > 0:
-                        cross_class_docs.append({
-                            "document_id": doc.id,
-                            "document_name": doc.name,
-                            "chunk_count": doc_chunks
-                        })
-            
-            return {
-                "class_id": class_id,
-                "class_name": class_obj.name,
-                "class_enabled": class_obj.enabled,
-                "assigned_documents": len(class_documents),
-                "document_details": [
-                    {
-                        "id": doc.id,
-                        "name": doc.name,
-                        "type": doc.file_type,
-                        "status": doc.status
-                    } for doc in class_documents
-                ],
-                "enabled_students": len(enabled_students),
-                "total_students": len(student_access),
-                "vector_index": index_stats,
-                "isolation_status": "SECURE" if not cross_class_docs else "WARNING",
-                "potential_leaks": cross_class_docs
-            }
+            return self.audit_class_isolation_from_cache(
+                class_obj, assigned_ids, enrollments, self._get_document_chunk_counts()
+            )
             
         except Exception as e:
             logger.error(f"Error auditing class isolation for {class_id}: {e}")
             return {"error": str(e)}
     
+    def audit_class_isolation_from_cache(
+        self,
+        class_obj: Class,
+        assigned_ids: Set[str],
+        enrollments: List[bool],
+        document_chunk_counts: List[Tuple[Document, int]]
+    ) -> Dict[str, any]:
+        """Audit one class from prefetched assignments, enrollments and documents."""
+        # Get vector index stats
+        index_stats = self.vector_db.get_index_stats(class_obj.id)
+        
+        assigned_documents = []
+        cross_class_docs = []
+        for doc, doc_chunks in document_chunk_counts:
+            if doc.id in assigned_ids:
+                assigned_documents.append(doc)
+            # Check if any chunks from this doc might be in the class index
+            elif doc_chunks > 0:
+                cross_class_docs.append({
+                    "document_id": doc.id,
+                    "document_name": doc.name,
+                    "chunk_count": doc_chunks
+                })
+        
+        return {
+            "class_id": class_obj.id,
+            "class_name": class_obj.name,
+            "class_enabled": class_obj.enabled,
+            "assigned_documents": len(assigned_documents),
+            "document_details": [
+                {
+                    "id": doc.id,
+                    "name": doc.name,
+                    "type": doc.file_type,
+                    "status": doc.status
+                } for doc in assigned_documents
+            ],
+            "enabled_students": sum(1 for enabled in enrollments if enabled),
+            "total_students": len(enrollments),
+            "vector_index": index_stats,
+            "isolation_status": "SECURE" if not cross_class_docs else "WARNING",
+            "potential_leaks": cross_class_docs
+        }
+    
+    def audit_all_classes(self) -> List[Dict[str, any]]:
+        """Audit every class from a fixed number of bulk queries."""
+        classes = self.db.query(Class).all()
+        
+        assignments = defaultdict(set)
+        for class_id, document_id in self.db.execute(
+            select(class_documents.c.class_id, class_documents.c.document_id)
+        ):
+            assignments[class_id].add(document_id)
+        
+        enrollments = defaultdict(list)
+        for class_id, enabled in self.db.execute(select(StudentAccess.class_id, StudentAccess.enabled)):
+            enrollments[class_id].append(enabled)
+        
+        document_chunk_counts = self._get_document_chunk_counts()
+        
+        audits = []
+        for class_obj in classes:
+            try:
+                audits.append(self.audit_class_isolation_from_cache(
+                    class_obj, assignments[class_obj.id], enrollments[class_obj.id], document_chunk_counts
+                ))
+            except Exception as e:
+                logger.error(f"Error auditing class isolation for {class_obj.id}: {e}")
+                audits.append({"error": str(e)})
+        return audits
+    
     def bulk_assign_documents(self, document_ids: List[str], class_id: str) -> Dict[str, any]:
         """Bulk assign multiple documents to a class."""
         try:
@@ -283,8 +327,53 @@ class ClassIsolationService:
                 "total": len(document_ids)
             }
             
+            class_obj = self.db.query(Class).filter(Class.id == class_id).first()
+            if not class_obj:
+                logger.error(f"Class not found: {class_id}")
+                results["failed"] = list(document_ids)
+                return results
+            
+            existing_ids = {
+                row[0] for row in self.db.query(Document.id).filter(Document.id.in_(document_ids)).all()
+            }
+            newly_assigned_ids = existing_ids - {
+                row[0] for row in self.db.query(class_documents.c.document_id).filter(
+                    class_documents.c.class_id == class_id,
+                    class_documents.c.document_id.in_(existing_ids)
+                ).all()
+            }
+            
+            # Insert every missing assignment in one statement
+            if newly_assigned_ids:
+                self.db.execute(
+                    insert(class_documents).from_select(
+                        ["class_id", "document_id"],
+                        select(literal(class_id), Document.id).where(
+                            Document.id.in_(newly_assigned_ids),
+                            ~exists().where(
+                                class_documents.c.class_id == class_id,
+                                class_documents.c.document_id == Document.id
+                            )
+                        )
+                    )
+                )
+                self.db.commit()
+                
+                # Add embeddings for the newly assigned documents to the class index
+                chunks = self.db.query(DocumentChunk).filter(
+                    DocumentChunk.document_id.in_(newly_assigned_ids)
+                ).all()
+                
+                if chunks:
+                    from .embedding_service import EmbeddingService
+                    embedding_service = EmbeddingService()
+                    
+                    embeddings = embedding_service.generate_embeddings([chunk.content for chunk in chunks])
+                    self.vector_db.add_embeddings(class_id, embeddings, [chunk.id for chunk in chunks])
+                    self.vector_db.save_index(class_id)
+            
             for doc_id in document_ids:
-                if self.assign_document_to_class(doc_id, class_id):
+                if doc_id in existing_ids:
                     results["successful"].append(doc_id)
                 else:
                     results["failed"].append(doc_id)
@@ -293,6 +382,7 @@ class ClassIsolationService:
             return results
             
         except Exception as e:
+            self.db.rollback()
             logger.error(f"Error in bulk document assignment: {e}")
             return {
                 "successful": [],
@@ -5,7 +5,9 @@ import logging
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 import pickle
+import functools
 import hashlib
+import threading
 
 # Sentence transformers for embeddings
 from sentence_transformers import SentenceTransformer
@@ -135,6 +137,15 @@ class EmbeddingService:
         return hashlib.md5(text.encode('utf-8')).hexdigest()
 
 
+def _synchronized(method):
+    """Run a VectorDatabase method while holding the instance lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class VectorDatabase:
     """Vector database using FAISS for similarity search."""
     
@@ -143,9 +154,13 @@ class VectorDatabase:
         self.indexes = {}  # Class-specific indexes
         self.chunk_mappings = {}  # Map index positions to chunk IDs
         self.data_dir = "data/vector_db"
+        # Held by every method that reads or changes an index and its chunk
+        # mapping, so positions and chunk IDs stay aligned across threads
+        self.lock = threading.RLock()
         
         os.makedirs(self.data_dir, exist_ok=True)
     
+    @_synchronized
     def create_class_index(self, class_id: str) -> bool:
         """Create a new FAISS index for a class."""
         try:
@@ -161,10 +176,11 @@ class VectorDatabase:
             logger.error(f"Error creating index for class {class_id}: {e}")
             return False
     
+    @_synchronized
     def add_embeddings(self, class_id: str, embeddings: np.ndarray, chunk_ids: List[str]) -> bool:
         """Add embeddings to class index."""
         try:
-            if class_id not in self.indexes:
+            if class_id not in self.indexes and not self.load_index(class_id):
                 self.create_class_index(class_id)
             
             index = self.indexes[class_id]
@@ -187,10 +203,11 @@ class VectorDatabase:
             logger.error(f"Error adding embeddings to class {class_id}: {e}")
             return False
     
+    @_synchronized
     def search(self, class_id: str, query_embedding: np.ndarray, k: int = 5) -> List[Tuple[str, float]]:
         """Search for similar embeddings in class index."""
         try:
-            if class_id not in self.indexes:
+            if class_id not in self.indexes and not self.load_index(class_id):
                 logger.warning(f"No index found for class: {class_id}")
                 return []
             
@@ -222,12 +239,13 @@ class VectorDatabase:
             logger.error(f"Error searching in class {class_id}: {e}")
             return []
     
+    @_synchronized
     def remove_document_embeddings(self, class_id: str, document_id: str, chunk_ids: List[str]) -> bool:
         """Remove embeddings for a specific document from class index."""
         try:
             # For simplicity, we'll rebuild the index without the removed chunks
             # In production, you might want a more efficient approach
-            if class_id not in self.indexes:
+            if class_id not in self.indexes and not self.load_index(class_id):
                 return True
             
             # Get current chunk mapping
@@ -258,6 +276,7 @@ class VectorDatabase:
             logger.error(f"Error removing document embeddings from class {class_id}: {e}")
             return False
     
+    @_synchronized
     def save_index(self, class_id: str) -> bool:
         """Save class index to disk."""
         try:
@@ -281,6 +300,7 @@ class VectorDatabase:
             logger.error(f"Error saving index for class {class_id}: {e}")
             return False
     
+    @_synchronized
     def load_index(self, class_id: str) -> bool:
         """Load class index from disk."""
         try:
@@ -305,9 +325,10 @@ class VectorDatabase:
             logger.error(f"Error loading index for class {class_id}: {e}")
             return False
     
+    @_synchronized
     def get_index_stats(self, class_id: str) -> Dict[str, Any]:
         """Get statistics for class index."""
-        if class_id not in self.indexes:
+        if class_id not in self.indexes and not self.load_index(class_id):
             return {"exists": False}
         
         index = self.indexes[class_id]
@@ -316,4 +337,20 @@ class VectorDatabase:
             "total_vectors": index.ntotal,
             "dimension": index.d,
             "chunk_count": len(self.chunk_mappings.get(class_id, []))
-        }
\ No newline at end of file
+        }
+
+
+# One vector database per process, so every reader and writer of a class index
+# sees the same in-memory state; see get_vector_database
+_vector_db: Optional[VectorDatabase] = None
+_vector_db_lock = threading.Lock()
+
+
+def get_vector_database(embedding_dim: int = 384) -> VectorDatabase:
+    """Get the process-wide vector database shared by the RAG and isolation services."""
+    global _vector_db
+    if _vector_db is None:
+        with _vector_db_lock:
+            if _vector_db is None:
+                _vector_db = VectorDatabase(embedding_dim=embedding_dim)
+    return _vector_db
@@ -1,13 +1,16 @@
 """RAG (Retrieval-Augmented Generation) service for query processing."""
 
+import copy
 import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
 from ..models.models import Document, DocumentChunk, Class
 from ..schemas.queries import QueryResponse, CitationResponse, DocumentReference
-from .embedding_service import EmbeddingService, VectorDatabase
+from .embedding_service import EmbeddingService, VectorDatabase, get_vector_database
 from .document_processor import DocumentProcessor
 
 
@@ -17,10 +20,10 @@ logger = logging.getLogger(__name__)
 class RAGService:
     """Service for processing queries using Retrieval-Augmented Generation."""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, vector_db: Optional[VectorDatabase] = None):
         self.db = db
         self.embedding_service = EmbeddingService()
-        self.vector_db = VectorDatabase(embedding_dim=self.embedding_service.embedding_dim)
+        self.vector_db = vector_db or VectorDatabase(embedding_dim=self.embedding_service.embedding_dim)
         self.document_processor = DocumentProcessor()
         
         # RAG configuration
@@ -36,7 +39,9 @@ class RAGService:
         try:
             classes = self.db.query(Class).all()
             for class_obj in classes:
-                self.vector_db.load_index(class_obj.id)
+                # A shared database may already hold newer state than the saved file
+                if class_obj.id not in self.vector_db.indexes:
+                    self.vector_db.load_index(class_obj.id)
             logger.info(f"Loaded indexes for {len(classes)} classes")
         except Exception as e:
             logger.error(f"Error loading existing indexes: {e}")
@@ -260,9 +265,13 @@ class RAGService:
             text_content = await self.document_processor._extract_text(document)
             chunks = self.document_processor._create_chunks(text_content, document.id)
             
-            # Save chunks to database
+            # Save chunks to database and refresh the cached chunk count
             for chunk in chunks:
                 self.db.add(chunk)
+            self.db.flush()
+            document.chunk_count = select(func.count(DocumentChunk.id)).where(
+                DocumentChunk.document_id == document.id
+            ).scalar_subquery()
             self.db.commit()
             
             # Generate embeddings for chunks
@@ -306,6 +315,7 @@ class RAGService:
             # Delete existing chunks
             for chunk in existing_chunks:
                 self.db.delete(chunk)
+            document.chunk_count = 0
             self.db.commit()
             
             # Reindex document
@@ -370,4 +380,25 @@ class RAGService:
     
     def get_class_index_stats(self, class_id: str) -> Dict[str, Any]:
         """Get statistics for class vector index."""
-        return self.vector_db.get_index_stats(class_id)
\ No newline at end of file
+        return self.vector_db.get_index_stats(class_id)
+
+
+# Shared service whose embedding model and document processor are reused
+# across requests; its vector indexes are the process-wide ones that
+# ClassIsolationService also writes. See get_rag_service
+_rag_service: Optional[RAGService] = None
+_rag_service_lock = threading.Lock()
+
+
+def get_rag_service(db: Session) -> RAGService:
+    """Get a RAG service bound to ``db`` that reuses the shared model and indexes."""
+    global _rag_service
+    if _rag_service is None:
+        with _rag_service_lock:
+            if _rag_service is None:
+                _rag_service = RAGService(db, vector_db=get_vector_database())
+    
+    # Shallow copy so concurrent requests never share a session
+    service = copy.copy(_rag_service)
+    service.db = db
+    return service
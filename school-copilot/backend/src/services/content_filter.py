@@ -165,7 +165,7 @@ class ContentFilter:
         matched_terms = []
         
         # Combine default and custom blocked terms
-        all_blocked_terms = list(set(self.default_blocked_terms + blocked_terms))
+        all_blocked_terms = list(dict.fromkeys(self.default_blocked_terms + blocked_terms))
         
         for term in all_blocked_terms:
             if term.lower() in query_lower:
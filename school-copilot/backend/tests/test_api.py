@@ -40,7 +40,8 @@ def client(db_session):
             pass
     
     app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as test_client:
+    # TrustedHostMiddleware rejects TestClient's default "testserver" host
+    with TestClient(app, base_url="http://localhost") as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
@@ -132,6 +133,34 @@ class TestClassEndpoints:
         data = response.json()
         assert isinstance(data, list)
     
+    def test_list_classes_counts(self, client, auth_headers, db_session):
+        """Test class listing reports enabled students and assigned documents."""
+        teacher = db_session.query(User).filter(User.email == "teacher@example.edu").first()
+        class_obj = Class(id="class_counts", name="Counted Class", teacher_id=teacher.id)
+        class_obj.documents = [
+            Document(id=f"doc_{i}", name=f"Doc {i}", file_path=f"/tmp/doc_{i}.pdf", file_type="pdf", file_size=1)
+            for i in range(3)
+        ]
+        db_session.add_all([
+            class_obj,
+            User(id="student_a", email="a@example.edu", name="Student A", role="student"),
+            User(id="student_b", email="b@example.edu", name="Student B", role="student"),
+            StudentAccess(student_id="student_a", class_id="class_counts", enabled=True),
+            StudentAccess(student_id="student_b", class_id="class_counts", enabled=False),
+        ])
+        db_session.commit()
+        
+        response = client.get("/api/classes/", headers=auth_headers)
+        assert response.status_code == 200
+        data = {item["id"]: item for item in response.json()}
+        assert data["class_counts"]["student_count"] == 1
+        assert data["class_counts"]["document_count"] == 3
+        
+        response = client.get("/api/classes/class_counts", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["student_count"] == 1
+        assert response.json()["document_count"] == 3
+    
     def test_create_class_without_auth(self, client):
         """Test creating class without authentication."""
         response = client.post("/api/classes/", json={
@@ -191,6 +220,20 @@ class TestLogEndpoints:
         data = response.json()
         assert isinstance(data, list)
     
+    def test_get_logs_not_modified(self, client, auth_headers):
+        """Test that an unchanged log page is answered with 304."""
+        response = client.get("/api/logs/", headers=auth_headers)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        
+        response = client.get("/api/logs/", headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
+        # Another page of the same window must not be answered from the first
+        response = client.get("/api/logs/?offset=50", headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
     def test_get_logs_summary(self, client, auth_headers):
         """Test getting logs summary."""
         response = client.get("/api/logs/summary", headers=auth_headers)
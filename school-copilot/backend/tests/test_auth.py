@@ -2,15 +2,24 @@
 
 import pytest
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
+from unittest.mock import patch
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
-from ..models.database import Base
-from ..models.models import User, Class, StudentAccess
+from ..models.database import Base, get_db
+from ..models.models import User, Class, StudentAccess, Document
+from ..auth import jwt_handler as jwt_handler_module
 from ..auth.jwt_handler import JWTHandler
 from ..auth.auth_service import AuthService
-from ..auth.dependencies import PermissionChecker
+from ..auth import auth_service as auth_service_module, dependencies
+from ..auth.dependencies import PermissionChecker, get_current_user
+from ..auth import permissions
+from ..auth.permissions import PermissionService
+from ..api import auth as auth_api
 from ..schemas.auth import LoginRequest
 
 
@@ -95,14 +104,72 @@ class TestJWTHandler:
         token_data = jwt_handler.verify_token(invalid_token)
         assert token_data is None
     
+    def test_invalid_token_not_cached(self, jwt_handler):
+        """Test failed verifications are retried rather than cached."""
+        token = f"{'a' * 16}.{'b' * 16}.{'c' * 16}"
+        with patch.object(jwt_handler_module.jwt, "decode", side_effect=jwt_handler_module.jwt.PyJWTError) as decode:
+            assert jwt_handler.verify_token(token) is None
+            assert jwt_handler.verify_token(token) is None
+            assert decode.call_count == 2
+    
+    def test_malformed_token_rejected_before_decode(self, jwt_handler):
+        """Test tokens of the wrong shape never reach signature verification."""
+        valid = jwt_handler.create_access_token({
+            "sub": "user_shape",
+            "email": "shape@example.edu",
+            "role": "student"
+        })
+        with patch.object(jwt_handler, "_decode_token") as decode:
+            for token in ("short", valid + ".extra", valid.replace(".", "!", 1), "a" * 5000):
+                assert jwt_handler.verify_token(token) is None
+            decode.assert_not_called()
+    
+    def test_tampered_token_rejected(self, jwt_handler):
+        """Test tokens with a forged payload or signature fail verification."""
+        token = jwt_handler.create_access_token({
+            "sub": "user_tampered",
+            "email": "tampered@example.edu",
+            "role": "student"
+        })
+        header, payload, signature = token.split(".")
+        forged_payload = jwt_handler_module._b64url(
+            b'{"sub":"admin_001","email":"admin@example.edu","role":"admin","exp":9999999999}'
+        ).decode()
+        
+        assert jwt_handler.verify_token(f"{header}.{forged_payload}.{signature}") is None
+        assert jwt_handler.verify_token(f"{header}.{payload}.{signature[:-2]}AA") is None
+        assert jwt_handler.verify_token(f"{header}.{payload}") is None
+    
+    def test_library_signed_token_accepted(self, jwt_handler):
+        """Test tokens with a different header layout still verify."""
+        token = jwt_handler_module.jwt.encode(
+            {
+                "sub": "user_lib",
+                "email": "lib@example.edu",
+                "role": "teacher",
+                "exp": datetime.utcnow() + timedelta(minutes=5),
+            },
+            jwt_handler.secret_key,
+            algorithm="HS256",
+            headers={"kid": "primary"},
+        )
+        
+        token_data = jwt_handler.verify_token(token)
+        assert token_data is not None
+        assert token_data.role == "teacher"
+    
     def test_password_hashing(self, jwt_handler):
         """Test password hashing and verification."""
         password = "test_password_123"
         hashed = jwt_handler.hash_password(password)
         
         assert hashed != password
+        assert hashed.startswith("$argon2id$")
         assert jwt_handler.verify_password(password, hashed)
         assert not jwt_handler.verify_password("wrong_password", hashed)
+        
+        # Current hashes need no upgrade
+        assert jwt_handler.verify_and_update_password(password, hashed) == (True, None)
 
 
 class TestAuthService:
@@ -161,6 +228,20 @@ class TestAuthService:
         auth_response = auth_service.authenticate_user(login_request)
         # In a real test, we'd assert auth_response is not None
     
+    async def test_repeat_login_skips_password_hash(self, auth_service):
+        """Test a recently verified password is not hashed again."""
+        auth_service.create_user("cached@example.edu", "Cached User", "student", password="test123")
+        login_request = LoginRequest(email="cached@example.edu", password="test123", domain="example.edu")
+        
+        assert await auth_service.authenticate_user(login_request) is not None
+        
+        with patch.object(auth_service_module.jwt_handler, "verify_and_update_password") as verify:
+            assert await auth_service.authenticate_user(login_request) is not None
+            verify.assert_not_called()
+        
+        wrong_request = LoginRequest(email="cached@example.edu", password="wrong", domain="example.edu")
+        assert await auth_service.authenticate_user(wrong_request) is None
+    
     def test_check_user_permissions(self, auth_service):
         """Test user permission checking."""
         # Create users with different roles
@@ -194,9 +275,98 @@ class TestAuthService:
         assert updated_user.is_active is False
 
 
+class TestTokenCache:
+    """Test caching of verified bearer tokens."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_caches(self):
+        """Start every test with empty token caches."""
+        for cache in (
+            dependencies.token_cache,
+            dependencies.revoked_tokens,
+            dependencies.revoked_users,
+            auth_service_module._recent_activity,
+        ):
+            cache.clear()
+    
+    @pytest.fixture
+    def credentials(self, db_session, jwt_handler):
+        """Create an active user and a bearer token for it."""
+        user = User(id="user_1", email="test@example.edu", name="Test User", role="student")
+        db_session.add(user)
+        db_session.commit()
+        token = jwt_handler.create_user_token(user)
+        return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    
+    async def test_repeat_token_skips_verification(self, db_session, credentials):
+        """Test a cached token is not decoded again."""
+        user = await get_current_user(credentials, db_session)
+        assert user.id == "user_1"
+        
+        with patch.object(dependencies, "verify_token") as verify:
+            cached_user = await get_current_user(credentials, db_session)
+            verify.assert_not_called()
+        
+        assert cached_user.id == "user_1"
+        assert cached_user.email == "test@example.edu"
+    
+    async def test_activity_recorded_in_background(self, db_session, credentials):
+        """Test the activity write is deferred and coalesced per user."""
+        background_tasks = BackgroundTasks()
+        await get_current_user(credentials, db_session, background_tasks)
+        await get_current_user(credentials, db_session, background_tasks)
+        
+        assert len(background_tasks.tasks) == 1
+        assert background_tasks.tasks[0].func is auth_service_module.record_user_activity
+        assert background_tasks.tasks[0].args == ("user_1",)
+    
+    async def test_revoked_token_rejected(self, db_session, credentials):
+        """Test a logged-out token is rejected even if cached."""
+        await get_current_user(credentials, db_session)
+        dependencies.invalidate_token(dependencies.hash_token(credentials.credentials), revoke=True)
+        
+        with pytest.raises(HTTPException):
+            await get_current_user(credentials, db_session)
+    
+    async def test_deactivated_user_bypasses_cache(self, db_session, auth_service, credentials):
+        """Test deactivation takes effect before the cache entry expires."""
+        await get_current_user(credentials, db_session)
+        auth_service.deactivate_user("user_1")
+        dependencies.invalidate_user("user_1")
+        
+        with pytest.raises(HTTPException):
+            await get_current_user(credentials, db_session)
+    
+    def test_validate_token_not_modified(self, db_session, credentials):
+        """Test a matching ETag is answered with 304 while the token is cached."""
+        app = FastAPI()
+        app.include_router(auth_api.router, prefix="/api/auth")
+        app.dependency_overrides[get_db] = lambda: db_session
+        client = TestClient(app)
+        headers = {"Authorization": f"Bearer {credentials.credentials}"}
+        
+        response = client.get("/api/auth/validate-token", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == dependencies.TOKEN_CACHE_CONTROL
+        etag = response.headers["ETag"]
+        
+        response = client.get("/api/auth/validate-token", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        
+        # A revoked token must be re-validated rather than served from the client cache
+        dependencies.invalidate_token(dependencies.hash_token(credentials.credentials), revoke=True)
+        response = client.get("/api/auth/validate-token", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 401
+
+
 class TestPermissionChecker:
     """Test permission checking functionality."""
     
+    @pytest.fixture(autouse=True)
+    def clear_access_cache(self):
+        """Start every test without cached class access decisions."""
+        dependencies._access_cache.clear()
+    
     def test_can_access_class(self, db_session):
         """Test class access permissions."""
         # Create test data
@@ -229,6 +399,99 @@ class TestPermissionChecker:
         # Student cannot access class they're not enrolled in
         assert not checker.can_access_class(student, "nonexistent_class")
     
+    def test_class_access_cached_until_invalidated(self, db_session):
+        """Test enrollment changes take effect once the cached decision is invalidated."""
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=True)
+        db_session.add_all([student, class_obj, access])
+        db_session.commit()
+        
+        checker = PermissionChecker(db_session)
+        assert checker.can_access_class(student, "class_1")
+        with patch.object(checker, "_query_class_access") as query:
+            assert checker.can_access_class(student, "class_1")
+            query.assert_not_called()
+        
+        # Committed ORM changes drop the cached decision
+        access.enabled = False
+        db_session.commit()
+        assert not checker.can_access_class(student, "class_1")
+        
+        # Core statements bypass the ORM events and invalidate explicitly
+        db_session.execute(
+            update(StudentAccess).where(StudentAccess.id == access.id).values(enabled=True)
+        )
+        db_session.commit()
+        dependencies.invalidate_class_access("student_1", "class_1")
+        assert checker.can_access_class(student, "class_1")
+    
+    def test_class_access_dropped_on_teacher_change(self, db_session):
+        """Test reassigning a class revokes the previous teacher's cached access."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        other_teacher = User(id="teacher_2", email="other@example.edu", name="Other", role="teacher")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        db_session.add_all([teacher, other_teacher, class_obj])
+        db_session.commit()
+        
+        checker = PermissionChecker(db_session)
+        assert checker.can_access_class(teacher, "class_1")
+        assert not checker.can_access_class(other_teacher, "class_1")
+        
+        class_obj.teacher_id = "teacher_2"
+        db_session.commit()
+        assert not checker.can_access_class(teacher, "class_1")
+        assert checker.can_access_class(other_teacher, "class_1")
+    
+    def test_check_class_access(self, db_session):
+        """Test class access checks return the loaded class."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        other_teacher = User(id="teacher_2", email="other@example.edu", name="Other", role="teacher")
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        admin = User(id="admin_1", email="admin@example.edu", name="Admin", role="admin")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=False)
+        
+        db_session.add_all([teacher, other_teacher, student, admin, class_obj, access])
+        db_session.commit()
+        
+        checker = PermissionChecker(db_session)
+        
+        assert checker.check_class_access(admin, "class_1") is class_obj
+        assert checker.check_class_access(teacher, "class_1") is class_obj
+        assert checker.check_class_access(other_teacher, "class_1") is None
+        assert checker.check_class_access(admin, "nonexistent_class") is None
+        
+        # Disabled enrollment does not grant access
+        assert checker.check_class_access(student, "class_1") is None
+        access.enabled = True
+        db_session.commit()
+        assert checker.check_class_access(student, "class_1").id == "class_1"
+    
+    def test_preload_managed_documents(self, db_session):
+        """Test preloaded document ownership matches the per-document check."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        other_teacher = User(id="teacher_2", email="other@example.edu", name="Other", role="teacher")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        owned = Document(id="doc_1", name="Owned", file_path="/tmp/doc_1", file_type="pdf", file_size=1)
+        unassigned = Document(id="doc_2", name="Unassigned", file_path="/tmp/doc_2", file_type="pdf", file_size=1)
+        owned.assigned_classes.append(class_obj)
+        
+        db_session.add_all([teacher, other_teacher, class_obj, owned, unassigned])
+        db_session.commit()
+        
+        doc_ids = ["doc_1", "doc_2", "missing_doc"]
+        checker = PermissionChecker(db_session)
+        checker.preload_managed_documents(teacher, doc_ids)
+        
+        with patch.object(db_session, "query", side_effect=AssertionError("unexpected query")):
+            assert checker.can_manage_document(teacher, "doc_1")
+            assert not checker.can_manage_document(teacher, "doc_2")
+            assert not checker.can_manage_document(teacher, "missing_doc")
+        
+        # Another user's checks are not answered from the preloaded set
+        assert not checker.can_manage_document(other_teacher, "doc_1")
+    
     def test_can_view_audit_logs(self, db_session):
         """Test audit log viewing permissions."""
         teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
@@ -248,4 +511,198 @@ class TestPermissionChecker:
         assert checker.can_view_audit_logs(teacher)
         
         # Student cannot view logs
-        assert not checker.can_view_audit_logs(student)
\ No newline at end of file
+        assert not checker.can_view_audit_logs(student)
+
+
+class TestPermissionService:
+    """Test permission service queries against a real session."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_class_meta(self):
+        """Start every test without cached class settings."""
+        permissions._class_meta_cache.clear()
+    
+    def test_get_user_classes_student_single_query(self, db_session):
+        """Test a student's classes are loaded with one query regardless of enrollments."""
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        db_session.add(student)
+        for i in range(3):
+            db_session.add(Class(id=f"class_{i}", name=f"Class {i}", teacher_id="teacher_1"))
+            db_session.add(StudentAccess(student_id="student_1", class_id=f"class_{i}", enabled=i != 2))
+        db_session.commit()
+        db_session.refresh(student)
+        
+        statements = []
+        engine = db_session.get_bind()
+        
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            classes = PermissionService(db_session).get_user_classes(student)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        
+        assert len(statements) == 1
+        assert sorted(cls["id"] for cls in classes) == ["class_0", "class_1", "class_2"]
+        assert [cls["enabled"] for cls in sorted(classes, key=lambda cls: cls["id"])] == [True, True, False]
+    
+    def test_check_document_access(self, db_session):
+        """Test document access follows class assignment and enrollment."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        other_teacher = User(id="teacher_2", email="other@example.edu", name="Other", role="teacher")
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        document = Document(
+            id="doc_1", name="Notes", file_path="/tmp/notes.pdf", file_type="pdf", file_size=100
+        )
+        document.assigned_classes.append(class_obj)
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=True)
+        db_session.add_all([teacher, other_teacher, student, class_obj, document, access])
+        db_session.commit()
+        
+        service = PermissionService(db_session)
+        
+        result = service.check_document_access(teacher, "doc_1")
+        assert result["has_access"] and result["can_manage"]
+        assert result["assigned_classes"] == []
+        assert service.check_document_access(teacher, "doc_1", include_classes=True)["assigned_classes"] == ["class_1"]
+        
+        result = service.check_document_access(student, "doc_1")
+        assert result["has_access"] and not result["can_manage"]
+        
+        result = service.check_document_access(other_teacher, "doc_1", include_classes=True)
+        assert not result["has_access"]
+        assert result["assigned_classes"] == []
+        assert service.check_document_access(teacher, "missing")["reason"] == "Document not found"
+    
+    def test_check_audit_log_access(self, db_session):
+        """Test teachers may view logs only for classes they teach."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        db_session.add_all([
+            teacher,
+            Class(id="class_1", name="Math 101", teacher_id="teacher_1"),
+            Class(id="class_2", name="Science 101", teacher_id="teacher_1"),
+            Class(id="class_3", name="History 101", teacher_id="teacher_2"),
+        ])
+        db_session.commit()
+        
+        service = PermissionService(db_session)
+        
+        result = service.check_audit_log_access(teacher)
+        assert result["has_access"]
+        assert sorted(result["accessible_classes"]) == ["class_1", "class_2"]
+        
+        result = service.check_audit_log_access(teacher, class_id="class_2")
+        assert result["has_access"]
+        assert result["accessible_classes"] == ["class_2"]
+        
+        result = service.check_audit_log_access(teacher, class_id="class_3")
+        assert not result["has_access"]
+        assert result["reason"] == "Cannot access logs for this class"
+    
+    def test_checks_memoized_per_service(self, db_session):
+        """Test repeated checks reuse the first result and callers get their own copy."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        db_session.add_all([teacher, Class(id="class_1", name="Math 101", teacher_id="teacher_1")])
+        db_session.commit()
+        
+        service = PermissionService(db_session)
+        first = service.check_class_access(teacher, "class_1")
+        first["has_access"] = False
+        
+        with patch.object(service, "_check_class_access") as check:
+            assert service.check_class_access(teacher, "class_1")["has_access"]
+            check.assert_not_called()
+
+        first["blocked_terms"].append("cheat")
+        assert service.check_class_access(teacher, "class_1")["blocked_terms"] == []
+
+    def test_question_count_refreshes_memoized_check(self, db_session):
+        """Test remaining questions are recomputed after a question is counted."""
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1", daily_question_limit=5)
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=True)
+        db_session.add_all([student, class_obj, access])
+        db_session.commit()
+
+        service = PermissionService(db_session)
+        assert service.check_class_access(student, "class_1")["remaining_questions"] == 5
+        assert service.increment_question_count("student_1", "class_1")
+        assert service.check_class_access(student, "class_1")["remaining_questions"] == 4
+
+    def test_class_meta_revalidated_by_version(self, db_session):
+        """Test cached class settings are reused until the class row changes."""
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Teacher", role="teacher")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1", daily_question_limit=20)
+        db_session.add_all([teacher, class_obj])
+        db_session.commit()
+        
+        assert PermissionService(db_session).check_class_access(teacher, "class_1")["daily_limit"] == 20
+        cached = permissions._class_meta_cache["class_1"]
+        assert permissions.get_class_meta(db_session, "class_1") is cached
+        
+        class_obj.blocked_terms = ["cheat"]
+        db_session.commit()
+        assert class_obj.version == cached.version + 1
+        
+        result = PermissionService(db_session).check_class_access(teacher, "class_1")
+        assert result["blocked_terms"] == ["cheat"]
+    
+    def test_validate_query_permissions_blocked_terms(self, db_session):
+        """Test students are stopped by the first listed blocked term in their query."""
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        class_obj = Class(
+            id="class_1", name="Math 101", teacher_id="teacher_1", blocked_terms=["Answer Key", "cheat"]
+        )
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=True)
+        db_session.add_all([student, class_obj, access])
+        db_session.commit()
+        
+        service = PermissionService(db_session)
+        result = service.validate_query_permissions(student, "class_1", "how to CHEAT with the answer key")
+        assert not result["allowed"]
+        assert result["blocked_term"] == "Answer Key"
+        
+        assert service.validate_query_permissions(student, "class_1", "explain fractions")["allowed"]
+    
+    def test_increment_question_count(self, db_session):
+        """Test the daily counter increments and restarts on a new day."""
+        access = StudentAccess(
+            student_id="student_1",
+            class_id="class_1",
+            daily_question_count=7,
+            last_question_date=datetime.utcnow() - timedelta(days=2)
+        )
+        db_session.add(access)
+        db_session.commit()
+        
+        service = PermissionService(db_session)
+        assert service.increment_question_count("student_1", "class_1")
+        assert service.increment_question_count("student_1", "class_1")
+        db_session.refresh(access)
+        assert access.daily_question_count == 2
+        
+        assert not service.increment_question_count("student_1", "missing_class")
+    
+    def test_check_class_access_student(self, db_session):
+        """Test student class access reflects enrollment and the enabled flag."""
+        student = User(id="student_1", email="student@example.edu", name="Student", role="student")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1", daily_question_limit=10)
+        access = StudentAccess(student_id="student_1", class_id="class_1", enabled=False)
+        db_session.add_all([student, class_obj, access])
+        db_session.commit()
+        
+        result = PermissionService(db_session).check_class_access(student, "class_1")
+        assert not result["has_access"]
+        assert result["reason"] == "Student access is disabled"
+        
+        access.enabled = True
+        db_session.commit()
+        result = PermissionService(db_session).check_class_access(student, "class_1")
+        assert result["has_access"]
+        assert result["remaining_questions"] == 10
+        
+        result = PermissionService(db_session).check_class_access(student, "class_2")
+        assert result["reason"] == "Class not found"
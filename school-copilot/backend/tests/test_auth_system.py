@@ -161,6 +161,9 @@ class TestPermissionService(unittest.TestCase):
     
     def setUp(self):
         """Set up test fixtures."""
+        from backend.auth import permissions
+        permissions._class_meta_cache.clear()
+        
         self.mock_db = Mock()
         
         # Mock user
@@ -198,7 +201,7 @@ class TestPermissionService(unittest.TestCase):
     
     def test_teacher_class_access(self):
         """Test teacher access to their own classes."""
-        from backend.auth.permissions import PermissionService
+        from backend.auth.permissions import PermissionService, invalidate_class_meta
         
         self.mock_db.query.return_value.filter.return_value.first.return_value = self.mock_class
         
@@ -208,8 +211,10 @@ class TestPermissionService(unittest.TestCase):
         result = permission_service.check_class_access(self.mock_teacher, "class123")
         self.assertTrue(result["has_access"])
         
-        # Teacher accessing another teacher's class
+        # Teacher accessing another teacher's class (fresh service: results are memoized per instance)
         self.mock_class.teacher_id = "other_teacher"
+        invalidate_class_meta("class123")
+        permission_service = PermissionService(self.mock_db)
         result = permission_service.check_class_access(self.mock_teacher, "class123")
         self.assertFalse(result["has_access"])
         self.assertEqual(result["reason"], "Not authorized to access this class")
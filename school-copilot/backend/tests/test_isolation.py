@@ -218,6 +218,20 @@ class TestClassIsolationService:
         audit_result = isolation_service.audit_class_isolation("nonexistent")
         assert "error" in audit_result
     
+    def test_audit_all_classes(self, db_session, sample_data):
+        """Test the bulk audit matches per-class audits."""
+        isolation_service = ClassIsolationService(db_session)
+        
+        # Setup: assign documents to classes
+        isolation_service.create_class_collection("class1")
+        isolation_service.assign_document_to_class("doc1", "class1")
+        
+        audits = {audit["class_id"]: audit for audit in isolation_service.audit_all_classes()}
+        
+        for class_id in ["class1", "class2"]:
+            assert audits[class_id] == isolation_service.audit_class_isolation(class_id)
+        assert audits["class1"]["assigned_documents"] == 1
+    
     def test_bulk_assign_documents(self, db_session, sample_data):
         """Test bulk document assignment."""
         isolation_service = ClassIsolationService(db_session)
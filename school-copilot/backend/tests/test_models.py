@@ -132,6 +132,37 @@ class TestModels:
         assert retrieved_access is not None
         assert retrieved_access.enabled is True
         assert retrieved_access.daily_question_count == 5
+    
+    def test_audit_log_query_raises_on_lazy_load(self, db_session):
+        """Test that audit log listings refuse to lazy load relationships."""
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm import raiseload
+        from ..api.logs import _AUDIT_LOG_LOAD_OPTIONS
+        
+        student = User(id="student_1", email="student@example.edu", name="Test Student", role="student")
+        teacher = User(id="teacher_1", email="teacher@example.edu", name="Test Teacher", role="teacher")
+        class_obj = Class(id="class_1", name="Math 101", teacher_id="teacher_1")
+        db_session.add_all([student, teacher, class_obj])
+        db_session.add(AuditLog(
+            student_id="student_1",
+            class_id="class_1",
+            query_text="What is photosynthesis?",
+            response_time_ms=1200,
+            success=True
+        ))
+        db_session.commit()
+        db_session.expunge_all()
+        
+        # Relationships used by the listing are eagerly loaded
+        log = db_session.query(AuditLog).options(*_AUDIT_LOG_LOAD_OPTIONS).first()
+        assert log.student.name == "Test Student"
+        assert log.class_.name == "Math 101"
+        
+        # Anything not explicitly loaded raises instead of issuing a query
+        db_session.expunge_all()
+        log = db_session.query(AuditLog).options(raiseload("*")).first()
+        with pytest.raises(InvalidRequestError):
+            log.student
 
 
 class TestValidation:
@@ -173,6 +204,9 @@ class TestValidation:
         assert ValidationUtils.validate_blocked_terms("What is math?", blocked_terms) is None
         assert ValidationUtils.validate_blocked_terms("This is inappropriate content", blocked_terms) == "inappropriate"
         assert ValidationUtils.validate_blocked_terms("BANNED word here", blocked_terms) == "banned"
+        # The first listed term is reported, regardless of where it occurs
+        assert ValidationUtils.validate_blocked_terms("banned and forbidden and inappropriate", blocked_terms) == "inappropriate"
+        assert ValidationUtils.validate_blocked_terms("a.b", ["a+b", "."]) == "."
     
     def test_file_validation(self):
         """Test file validation."""
@@ -182,6 +216,10 @@ class TestValidation:
         assert ValidationUtils.validate_file_type("Document.PDF", allowed_types)
         assert not ValidationUtils.validate_file_type("image.jpg", allowed_types)
         assert not ValidationUtils.validate_file_type("no_extension", allowed_types)
+        assert not ValidationUtils.validate_file_type(".pdf", allowed_types)
+        
+        assert ValidationUtils.get_file_extension("notes.final.DOCX") == "docx"
+        assert ValidationUtils.get_file_extension("no_extension") == ""
         
         # Test file size (50MB limit)
         assert ValidationUtils.validate_file_size(1024 * 1024)  # 1MB
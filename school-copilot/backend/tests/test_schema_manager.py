@@ -220,6 +220,88 @@ class TestSchemaIntegration:
             assert row[0] == "Math 101"
             assert row[1] == "Test Teacher"
 
+    def test_upgrade_schema_adds_missing_columns(self, schema_manager):
+        """Test that databases created before a column existed are upgraded in place."""
+        with schema_manager.engine.connect() as conn:
+            conn.execute(text("CREATE TABLE classes (id TEXT PRIMARY KEY, name TEXT NOT NULL)"))
+            conn.execute(text("INSERT INTO classes (id, name) VALUES ('class1', 'Math 101')"))
+            conn.execute(text("CREATE TABLE documents (id TEXT PRIMARY KEY, name TEXT NOT NULL)"))
+            conn.execute(text("CREATE TABLE document_chunks (id TEXT PRIMARY KEY, document_id TEXT NOT NULL)"))
+            conn.execute(text("INSERT INTO documents (id, name) VALUES ('doc1', 'Algebra Book')"))
+            conn.execute(text("INSERT INTO document_chunks (id, document_id) VALUES ('c1', 'doc1'), ('c2', 'doc1')"))
+            conn.commit()
+
+        assert schema_manager.upgrade_schema() is True
+        # Running it again is a no-op
+        assert schema_manager.upgrade_schema() is True
+
+        with schema_manager.engine.connect() as conn:
+            version = conn.execute(text("SELECT version FROM classes WHERE id = 'class1'")).scalar()
+            assert version == 1
+            # New counters are filled from the rows already stored
+            chunk_count = conn.execute(text("SELECT chunk_count FROM documents WHERE id = 'doc1'")).scalar()
+            assert chunk_count == 2
+
+    def test_upgrade_schema_adds_student_access_unique_key(self, schema_manager):
+        """Test that duplicate enrollments are collapsed so access upserts can run."""
+        with schema_manager.engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE student_access (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT NOT NULL,
+                    class_id TEXT NOT NULL,
+                    enabled BOOLEAN DEFAULT TRUE
+                )
+            """))
+            conn.execute(text("""
+                INSERT INTO student_access (student_id, class_id, enabled)
+                VALUES ('s1', 'class1', 1), ('s1', 'class1', 0), ('s2', 'class1', 1)
+            """))
+            conn.commit()
+
+        assert schema_manager.upgrade_schema() is True
+        assert schema_manager.upgrade_schema() is True
+
+        with schema_manager.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT student_id, enabled FROM student_access ORDER BY student_id"
+            )).fetchall()
+            assert [tuple(row) for row in rows] == [("s1", 0), ("s2", 1)]
+
+            conn.execute(text("""
+                INSERT INTO student_access (student_id, class_id, enabled) VALUES ('s1', 'class1', 1)
+                ON CONFLICT (student_id, class_id) DO UPDATE SET enabled = excluded.enabled
+            """))
+            enabled = conn.execute(text("SELECT enabled FROM student_access WHERE student_id = 's1'")).scalar()
+            assert enabled == 1
+
+    def test_upgrade_schema_adds_missing_indexes(self, schema_manager):
+        """Test that lookup indexes declared on the models reach existing tables."""
+        with schema_manager.engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE audit_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT NOT NULL,
+                    class_id TEXT NOT NULL,
+                    success BOOLEAN,
+                    timestamp DATETIME
+                )
+            """))
+            conn.commit()
+
+        assert schema_manager.upgrade_schema() is True
+        assert schema_manager.upgrade_schema() is True
+
+        with schema_manager.engine.connect() as conn:
+            indexes = {row[0] for row in conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'audit_logs'"
+            ))}
+        assert {
+            "idx_audit_logs_class_timestamp",
+            "idx_audit_logs_student_timestamp",
+            "idx_audit_logs_class_success_timestamp",
+        } <= indexes
+
 
 class TestConvenienceFunctions:
     """Test convenience functions."""
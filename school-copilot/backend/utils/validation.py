@@ -2,7 +2,9 @@
 
 import re
 import json
-from typing import Any, Dict, List, Optional, Union
+from functools import lru_cache
+from pathlib import PurePosixPath
+from typing import Any, Dict, List, Optional, Pattern, Tuple, Union
 from datetime import datetime, date
 from pydantic import ValidationError, validator
 from ..schemas.queries import QueryRequest
@@ -10,6 +12,24 @@ from ..schemas.documents import DocumentCreate, DocumentUpdate
 from ..schemas.classes import ClassCreate, ClassUpdate
 from ..schemas.auth import LoginRequest
 
+# Patterns compiled once at import time
+_IDENTIFIER_RE = re.compile(r"^[a-zA-Z0-9_-]{3,50}$")
+_SESSION_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{8,64}$")
+_CLASS_NAME_RE = re.compile(r"^[a-zA-Z0-9\s_-]+$")
+_UNSAFE_QUERY_CHARS_RE = re.compile(r'[<>"\';\\]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
+@lru_cache(maxsize=1024)
+def compile_blocked_terms(blocked_terms: Tuple[str, ...]) -> Pattern:
+    """Compile a class's blocked terms into one pattern over lowercased text.
+    
+    Keyed by the terms themselves, so editing a class's list simply
+    compiles a new matcher on first use.
+    """
+    return re.compile("|".join(re.escape(term.lower()) for term in blocked_terms))
+
 
 class ValidationUtils:
     """Utility class for data validation."""
@@ -27,15 +47,13 @@ class ValidationUtils:
     def validate_student_id(student_id: str) -> bool:
         """Validate student ID format."""
         # Allow alphanumeric with hyphens and underscores, 3-50 characters
-        pattern = r"^[a-zA-Z0-9_-]{3,50}$"
-        return bool(re.match(pattern, student_id))
+        return bool(_IDENTIFIER_RE.match(student_id))
     
     @staticmethod
     def validate_class_id(class_id: str) -> bool:
         """Validate class ID format."""
         # Allow alphanumeric with hyphens and underscores, 3-50 characters
-        pattern = r"^[a-zA-Z0-9_-]{3,50}$"
-        return bool(re.match(pattern, class_id))
+        return bool(_IDENTIFIER_RE.match(class_id))
     
     @staticmethod
     def sanitize_query_text(query: str) -> str:
@@ -44,13 +62,13 @@ class ValidationUtils:
             return ""
         
         # Remove potentially dangerous characters
-        sanitized = re.sub(r'[<>"\';\\]', '', query)
+        sanitized = _UNSAFE_QUERY_CHARS_RE.sub('', query)
         
         # Limit length
         sanitized = sanitized[:1000]
         
         # Remove excessive whitespace
-        sanitized = re.sub(r'\s+', ' ', sanitized).strip()
+        sanitized = _WHITESPACE_RE.sub(' ', sanitized).strip()
         
         return sanitized
     
@@ -60,21 +78,28 @@ class ValidationUtils:
         if not blocked_terms:
             return None
         
+        # Single scan for the common no-match case
         query_lower = query.lower()
+        if not compile_blocked_terms(tuple(blocked_terms)).search(query_lower):
+            return None
+        
+        # Report the first listed term that matched
         for term in blocked_terms:
             if term.lower() in query_lower:
                 return term
         
         return None
     
+    @staticmethod
+    def get_file_extension(filename: Optional[str]) -> str:
+        """Get a filename's lowercased extension without the dot, or ''."""
+        return PurePosixPath(filename or "").suffix[1:].lower()
+    
     @staticmethod
     def validate_file_type(filename: str, allowed_types: List[str]) -> bool:
         """Validate file type based on extension."""
-        if not filename or "." not in filename:
-            return False
-        
-        extension = filename.split(".")[-1].lower()
-        return extension in [t.lower() for t in allowed_types]
+        extension = ValidationUtils.get_file_extension(filename)
+        return bool(extension) and extension in [t.lower() for t in allowed_types]
     
     @staticmethod
     def validate_file_size(file_size: int, max_size_mb: int = 50) -> bool:
@@ -104,8 +129,7 @@ class ValidationUtils:
     def validate_session_id(session_id: str) -> bool:
         """Validate session ID format."""
         # UUID-like format or alphanumeric with hyphens
-        pattern = r"^[a-zA-Z0-9_-]{8,64}$"
-        return bool(re.match(pattern, session_id))
+        return bool(_SESSION_ID_RE.match(session_id))
     
     @staticmethod
     def validate_document_name(name: str) -> bool:
@@ -132,8 +156,7 @@ class ValidationUtils:
             return False
         
         # Allow letters, numbers, spaces, hyphens, underscores
-        pattern = r"^[a-zA-Z0-9\s_-]+$"
-        return bool(re.match(pattern, name.strip()))
+        return bool(_CLASS_NAME_RE.match(name.strip()))
     
     @staticmethod
     def validate_daily_limit(limit: int) -> bool:
@@ -291,8 +314,7 @@ def validate_login_request(request: LoginRequest) -> Dict[str, Any]:
     warnings = []
     
     # Validate email format
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'$'
-    if not re.match(email_pattern, request.email):
+    if not _EMAIL_RE.match(request.email):
         errors.append("Invalid email format")
     
     # Validate domain
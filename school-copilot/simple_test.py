@@ -26,8 +26,8 @@ def test_installation():
         ('PyPDF2', 'PDF processing'),
         ('docx', 'Word document processing'),
         ('pptx', 'PowerPoint processing'),
-        ('passlib', 'Password hashing'),
-        ('jose', 'JWT tokens'),
+        ('argon2', 'Password hashing'),
+        ('jwt', 'JWT tokens'),
     ]
     
     working_packages = []
@@ -35,9 +35,7 @@ def test_installation():
     
     for package, description in packages_to_test:
         try:
-            if package == 'jose':
-                import jose
-            elif package == 'docx':
+            if package == 'docx':
                 import docx
             elif package == 'pptx':
                 import pptx
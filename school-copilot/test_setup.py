@@ -30,8 +30,8 @@ def check_dependencies():
         'PyPDF2',
         'python_docx',
         'python_pptx',
-        'passlib',
-        'python_jose'
+        'argon2',
+        'jwt'
     ]
     
     missing_packages = []
@@ -43,8 +43,6 @@ def check_dependencies():
                 importlib.import_module('docx')
             elif package == 'python_pptx':
                 importlib.import_module('pptx')
-            elif package == 'python_jose':
-                importlib.import_module('jose')
             elif package == 'faiss':
                 importlib.import_module('faiss')
             else: